@@ -0,0 +1,272 @@
+"""Офлайн-бенчмарк горячих путей бота на синтетических списках студентов
+
+Примеры:
+    python bench.py --sizes 1000,10000
+    python bench.py --sizes 100000 --save-baseline bench_baseline.json
+    python bench.py --sizes 100000 --baseline bench_baseline.json
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from typing import Dict, List
+
+# Токен и сеть бенчмарку не нужны, снимок и настройки не должны попадать на диск
+os.environ.setdefault('SNAPSHOT_FILE', '')
+os.environ.setdefault('SEARCH_LOG_LEVEL', 'ERROR')
+
+import main
+from main import PreferenceStore, StudentBot
+
+GROUPS = ['D1', 'D2', 'D3', 'D4']
+USER_ID = 1
+# Хвостовые перцентили на сотнях замеров слишком шумные для регрессий
+COMPARED_METRICS = ('p50_ms', 'p90_ms', 'mean_ms', 'parse_ms', 'index_ms', 'rss_delta_mb')
+
+FIRST_NAMES_LATIN = [
+    'Aziz', 'Bekzod', 'Dilshod', 'Jasur', 'Sardor', 'Shohruh', 'Otabek', 'Sanjar', 'Timur', 'Rustam',
+    'Dilnoza', 'Gulnora', 'Madina', 'Malika', 'Nigora', 'Sevara', 'Shahnoza', 'Zarina', 'Kamola', 'Feruza'
+]
+LAST_NAMES_LATIN = [
+    'Abdullayev', 'Karimov', 'Rahimov', 'Tursunov', 'Yusupov', "Xo'jayev", 'Ergashev', 'Nazarov',
+    'Qodirov', 'Saidov', 'Mirzayev', 'Sobirov', 'Umarov', 'Hasanov', "G'aniyev", 'Ismoilov'
+]
+PATRONYMICS_LATIN = ['Anvar o\'g\'li', 'Baxtiyor o\'g\'li', 'Shavkat qizi', 'Ravshan qizi', 'Olim o\'g\'li']
+FIRST_NAMES_CYRILLIC = [
+    'Азиз', 'Бекзод', 'Дильшод', 'Жасур', 'Сардор', 'Алексей', 'Дмитрий', 'Иван', 'Сергей', 'Тимур',
+    'Анна', 'Дильноза', 'Елена', 'Мадина', 'Малика', 'Мария', 'Наталья', 'Севара', 'Ольга', 'Зарина'
+]
+LAST_NAMES_CYRILLIC = [
+    'Абдуллаев', 'Каримов', 'Рахимов', 'Турсунов', 'Юсупов', 'Иванов', 'Петров', 'Смирнов',
+    'Кузнецов', 'Соколов', 'Назаров', 'Эргашев', 'Умаров', 'Хасанов', 'Исмоилов', 'Фёдоров'
+]
+PATRONYMICS_CYRILLIC = ['Анварович', 'Бахтиёрович', 'Сергеевич', 'Шавкатовна', 'Ивановна']
+CERTIFICATES = ['IELTS 6.5', 'IELTS 7.0', 'CEFR B2', 'CEFR C1', 'TOEFL 90', 'SAT 1350']
+
+
+class MemoryPreferenceStore(PreferenceStore):
+    """Языковые настройки только в памяти"""
+
+    def read_all(self) -> Dict[str, str]:
+        return {}
+
+    def write(self, pending: Dict[str, str]):
+        pass
+
+
+def random_name(rng: random.Random) -> str:
+    if rng.random() < 0.5:
+        parts = [rng.choice(LAST_NAMES_LATIN), rng.choice(FIRST_NAMES_LATIN)]
+        patronymic = PATRONYMICS_LATIN
+    else:
+        parts = [rng.choice(LAST_NAMES_CYRILLIC), rng.choice(FIRST_NAMES_CYRILLIC)]
+        patronymic = PATRONYMICS_CYRILLIC
+    if rng.random() < 0.6:
+        parts.append(rng.choice(patronymic))
+    return ' '.join(parts)
+
+
+def make_roster(rows: int, rng: random.Random) -> bytes:
+    """CSV группы в формате исходных таблиц: разделитель ';', редкие сертификаты"""
+    lines = ["№;F.I.Sh;Telefon nomeri;Nick name;Sertifikat 1;Sertifikat 2"]
+    for number in range(1, rows + 1):
+        phone = f"+99890{rng.randrange(10 ** 7):07d}" if rng.random() < 0.7 else ''
+        nickname = f"@user{rng.randrange(10 ** 6)}" if rng.random() < 0.3 else ''
+        cert1 = rng.choice(CERTIFICATES) if rng.random() < 0.15 else rng.choice(['', '-', ''])
+        cert2 = rng.choice(CERTIFICATES) if rng.random() < 0.03 else ''
+        lines.append(f"{number};{random_name(rng)};{phone};{nickname};{cert1};{cert2}")
+    return ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+def make_typo(word: str, rng: random.Random) -> str:
+    if len(word) < 4:
+        return word
+    position = rng.randrange(1, len(word) - 1)
+    return word[:position] + word[position + 1:]
+
+
+def make_queries(bot: StudentBot, names: List[str], count: int, rng: random.Random) -> Dict[str, List[str]]:
+    """Запросы разных видов по именам из загруженных данных"""
+    sample = [rng.choice(names) for _ in range(count)]
+    return {
+        'full': sample,
+        'surname': [name.split()[0] for name in sample],
+        'partial': [name.split()[0][:4] for name in sample],
+        'typo': [make_typo(name.split()[0], rng) for name in sample],
+        'translit': [main.transliterate(bot.normalize_text(name)) for name in sample],
+        'missing': [f"Qwxyzov {rng.randrange(10 ** 6)}" for _ in range(count)],
+    }
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    ordered = sorted(samples)
+
+    def pick(fraction: float) -> float:
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+    return {
+        'count': len(ordered),
+        'mean_ms': round(statistics.fmean(ordered), 4),
+        'p50_ms': round(pick(0.50), 4),
+        'p90_ms': round(pick(0.90), 4),
+        'p99_ms': round(pick(0.99), 4),
+        'max_ms': round(ordered[-1], 4),
+    }
+
+
+def measure(func, args_list) -> Dict[str, float]:
+    samples = []
+    for args in args_list:
+        started = time.perf_counter()
+        func(*args)
+        samples.append((time.perf_counter() - started) * 1000)
+    return percentiles(samples)
+
+
+def rss_mb() -> float:
+    """Резидентная память процесса (Linux), 0 если недоступно"""
+    try:
+        with open('/proc/self/statm') as statm:
+            pages = int(statm.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except (OSError, ValueError, IndexError):
+        return 0.0
+
+
+def run_size(size: int, query_count: int, seed: int) -> Dict:
+    rng = random.Random(seed)
+    per_group = max(1, size // len(GROUPS))
+    rosters = {group: make_roster(per_group, rng) for group in GROUPS}
+
+    rss_before = rss_mb()
+    bot = StudentBot(urls={}, autoload=False, preferences=MemoryPreferenceStore())
+    # Бенчмарковый экземпляр нужен и обработчикам, если они вызываются через модуль
+    main.bot = bot
+
+    # Данные загружаются тем же путем, что и скачанные CSV; разбор и построение
+    # индексов бот учитывает как фазы запуска
+    bot.update_groups({group: (raw, hashlib.sha1(raw).hexdigest()) for group, raw in rosters.items()})
+    parse_ms = bot.startup_timings.get('parse', 0.0) * 1000
+    index_ms = bot.startup_timings.get('index', 0.0) * 1000
+    rss_after = rss_mb()
+
+    names = [name for index in bot.state.group_indexes.values() for name in index.store.names]
+    queries = make_queries(bot, names, query_count, rng)
+    results = {
+        'rows': len(names),
+        'load': {'parse_ms': round(parse_ms, 2), 'index_ms': round(index_ms, 2)},
+        'memory': {'rss_delta_mb': round(rss_after - rss_before, 1), 'rss_mb': round(rss_after, 1)},
+        'search': {},
+    }
+
+    def uncached_search(query: str):
+        bot.search_cache.clear()
+        return bot.search_student(query)
+
+    for kind, kind_queries in queries.items():
+        results['search'][kind] = measure(uncached_search, [(query,) for query in kind_queries])
+    # Повторные запросы тех же имен обслуживаются кэшем результатов
+    for query in queries['full']:
+        bot.search_student(query)
+    results['search']['cached'] = measure(bot.search_student, [(query,) for query in queries['full']])
+
+    students = [student for query in queries['full'] for student in bot.search_student(query)[:1]]
+    results['format_student_info'] = measure(
+        bot.format_student_info, [(student, USER_ID) for student in students]
+    )
+
+    bot.state.stats_texts.clear()
+    results['get_statistics_cold'] = measure(bot.get_statistics, [(USER_ID,)])
+    results['get_statistics_warm'] = measure(bot.get_statistics, [(USER_ID,)] * query_count)
+
+    bot.state.group_pages.clear()
+    results['group_page_cold'] = measure(bot.get_group_page, [(group, 0, USER_ID) for group in bot.state.group_indexes])
+    page_args = [(rng.choice(GROUPS), rng.randrange(per_group // main.GROUP_PAGE_SIZE + 1), USER_ID)
+                 for _ in range(query_count)]
+    results['group_page_warm'] = measure(bot.get_group_page, page_args)
+
+    bot.user_languages.close()
+    return results
+
+
+def flatten(results: Dict, prefix: str = '') -> Dict[str, float]:
+    """Плоский словарь метрик вида '10000.search.full.p50_ms'"""
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}.{key}" if prefix else str(key)
+        if isinstance(value, dict):
+            flat.update(flatten(value, name))
+        elif name.endswith(COMPARED_METRICS):
+            flat[name] = value
+    return flat
+
+
+def compare(results: Dict, baseline: Dict, tolerance: float, min_ms: float) -> List[str]:
+    """Метрики, ухудшившиеся больше чем на tolerance относительно базовой линии"""
+    current = flatten(results)
+    regressions = []
+    for name, old in flatten(baseline).items():
+        new = current.get(name)
+        if new is None:
+            continue
+        # Совсем короткие замеры слишком шумные для сравнения в процентах
+        if name.endswith('_ms') and max(old, new) < min_ms:
+            continue
+        if new > old * (1 + tolerance) and new - old > (min_ms if name.endswith('_ms') else 1.0):
+            regressions.append(f"{name}: {old} -> {new} (+{(new / old - 1) * 100 if old else float('inf'):.0f}%)")
+    return regressions
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n', 1)[0])
+    parser.add_argument('--sizes', default='1000,10000,100000',
+                        help='размеры списков через запятую (всего студентов по всем группам)')
+    parser.add_argument('--queries', type=int, default=200, help='запросов каждого вида')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='сохранить результаты в JSON')
+    parser.add_argument('--baseline', help='сравнить с базовой линией из JSON')
+    parser.add_argument('--save-baseline', help='сохранить результаты как базовую линию')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='допустимое ухудшение (0.25 = 25%%)')
+    parser.add_argument('--min-ms', type=float, default=0.5, help='не сравнивать замеры короче этого')
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(',') if size]
+    for size in sizes:
+        if not 1 <= size <= 500000:
+            parser.error(f"размер {size} вне диапазона 1..500000")
+
+    # Диагностика загрузки бота в выводе бенчмарка не нужна
+    with open(os.devnull, 'w') as devnull:
+        results = {}
+        for size in sizes:
+            stdout, sys.stdout = sys.stdout, devnull
+            try:
+                results[str(size)] = run_size(size, args.queries, args.seed)
+            finally:
+                sys.stdout = stdout
+            print(json.dumps({size: results[str(size)]}, ensure_ascii=False, indent=2))
+
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(results, f, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance, args.min_ms)
+        if regressions:
+            print("Регрессии производительности:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print("Регрессий нет")
+
+
+if __name__ == '__main__':
+    main_cli()
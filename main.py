@@ -1,26 +1,46 @@
+import asyncio
+import contextlib
+import csv
+import ctypes
+import functools
+import hashlib
+import heapq
+import io
 import logging
+import mmap
+import multiprocessing
 import os
 import json
+import random
 import re
-from typing import Dict, List
-import requests
-
-# Сначала устанавливаем зависимости, если их нет
-try:
-    import pandas as pd
-except ImportError:
-    print("Pandas not found. Installing...")
-    os.system("pip install pandas==2.1.4")
-    import pandas as pd
-
-try:
-    from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, KeyboardButton
-    from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, ContextTypes, filters
-except ImportError:
-    print("python-telegram-bot not found. Installing...")
-    os.system("pip install python-telegram-bot==20.7")
-    from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, KeyboardButton
-    from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, ContextTypes, filters
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional
+
+# Фаза запуска import: время импорта внешних зависимостей
+IMPORT_STARTED = time.perf_counter()
+
+import httpx
+import numpy as np
+import pandas as pd
+import tornado.web
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from prometheus_client.registry import Collector
+from telegram import (Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, KeyboardButton,
+                      InlineQueryResultArticle, InputTextMessageContent)
+from telegram.ext import (Application, CommandHandler, MessageHandler, CallbackQueryHandler, InlineQueryHandler,
+                          ContextTypes, AIORateLimiter, filters)
+
+IMPORT_SECONDS = time.perf_counter() - IMPORT_STARTED
 
 # Настройка логирования
 logging.basicConfig(
@@ -28,14 +48,177 @@ logging.basicConfig(
     level=logging.INFO
 )
 logger = logging.getLogger(__name__)
+# Планировщик JobQueue пишет о каждом запуске задачи
+logging.getLogger('apscheduler').setLevel(logging.WARNING)
+
+# Трассировка поиска: уровень логгера, доля трассируемых запросов
+# и порог медленного запроса (мс), который пишется всегда
+search_logger = logging.getLogger(f'{__name__}.search')
+search_logger.setLevel(os.environ.get('SEARCH_LOG_LEVEL', 'INFO').upper())
+SEARCH_TRACE_SAMPLE_RATE = float(os.environ.get('SEARCH_TRACE_SAMPLE_RATE', 1.0))
+SEARCH_SLOW_MS = float(os.environ.get('SEARCH_SLOW_MS', 200))
 
 # Токен бота из переменных окружения
+# (проверяется при запуске, чтобы модуль можно было импортировать без токена)
 BOT_TOKEN = os.environ.get('BOT_TOKEN')
-if not BOT_TOKEN:
-    raise ValueError("BOT_TOKEN не найден в переменных окружения!")
 
-# Файл для хранения языковых настроек пользователей
+# Режим получения обновлений: 'polling' или 'webhook'
+BOT_MODE = os.environ.get('BOT_MODE', 'polling')
+# Вебхук: публичный адрес сервиса, путь, секрет для проверки запросов Telegram,
+# адрес и порт встроенного сервера вебхука python-telegram-bot (PORT выставляет Railway)
+WEBHOOK_URL = os.environ.get('WEBHOOK_URL', '').rstrip('/')
+WEBHOOK_PATH = os.environ.get('WEBHOOK_PATH', '/telegram')
+WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET', '')
+WEBHOOK_LISTEN = os.environ.get('WEBHOOK_LISTEN', '0.0.0.0')
+PORT = int(os.environ.get('PORT', 8080))
+
+# Служебный сервер: метрики в формате Prometheus (/metrics) и проверка
+# работоспособности (/health); адрес и порт (0 — отключить)
+METRICS_LISTEN = os.environ.get('METRICS_LISTEN', '127.0.0.1')
+METRICS_PORT = int(os.environ.get('METRICS_PORT', 9090))
+
+# Источники данных групп (CSV на Vercel Blob Storage)
+GROUP_URLS = {
+    'D1': 'https://hebbkx1anhila5yf.public.blob.vercel-storage.com/group_d1-PV7nQS7IQwFS9e2ps8nTKOBoGIv2br.csv',
+    'D2': 'https://hebbkx1anhila5yf.public.blob.vercel-storage.com/group_d2-WQjbXhJy4zuB1uPnTEYsP27kTALVq0.csv',
+    'D3': 'https://hebbkx1anhila5yf.public.blob.vercel-storage.com/group_d3-uPiNK14aokZuaaFV8DjGlyE94Qkkl9.csv',
+    'D4': 'https://hebbkx1anhila5yf.public.blob.vercel-storage.com/group_d4-ln5jYKnT5nlI7UQxO2xBBdXrvtMHV9.csv'
+}
+
+# Реестр групп: JSON-файл GROUPS_CONFIG или JSON в переменной GROUPS
+# (без них используются группы GROUP_URLS), число кнопок групп в ряду
+GROUPS_CONFIG = os.environ.get('GROUPS_CONFIG', 'groups.json')
+GROUP_KEYBOARD_COLUMNS = 2
+# Роли колонок, которые можно указать в реестре для каждой группы
+COLUMN_ROLES = ('name', 'phone', 'nickname', 'certificates')
+
+# Ленивая загрузка группы при первом обращении вместо загрузки всех при старте
+# и бюджет памяти на данные групп (МБ, 0 — без ограничения): при превышении
+# из памяти выгружаются давно не использованные группы
+GROUPS_LAZY = os.environ.get('GROUPS_LAZY', '0') == '1'
+GROUPS_MEMORY_BUDGET_MB = float(os.environ.get('GROUPS_MEMORY_BUDGET_MB', 0))
+# Пауза перед повторной попыткой загрузить группу, которая не загрузилась (сек)
+GROUP_RETRY_INTERVAL = 60
+
+# Параметры загрузки: таймаут на одну попытку (сек), число попыток, пауза между ними
+LOAD_TIMEOUT = float(os.environ.get('LOAD_TIMEOUT', 30))
+LOAD_RETRIES = int(os.environ.get('LOAD_RETRIES', 3))
+LOAD_RETRY_DELAY = 1.0
+
+# Сколько обработчик ждет начальной загрузки данных, прежде чем ответить
+# «данные загружаются» (сек)
+READY_TIMEOUT = float(os.environ.get('READY_TIMEOUT', 5))
+
+# Интервал фонового обновления данных (сек); 0 отключает обновление
+REFRESH_INTERVAL = float(os.environ.get('REFRESH_INTERVAL', 600))
+
+# Локальный снимок данных для быстрого старта; пустое значение отключает снимок
+SNAPSHOT_FILE = os.environ.get('SNAPSHOT_FILE', 'students_snapshot.bin')
+
+# Нечеткий поиск (транслитерация и опечатки): включен ли, максимум опечаток
+# в длинном слове и максимум нечетких результатов на запрос
+FUZZY_SEARCH = os.environ.get('FUZZY_SEARCH', '1') != '0'
+FUZZY_MAX_DISTANCE = 2
+FUZZY_MAX_RESULTS = 50
+# Слова длиннее и запросы из большего числа слов ищутся без опечаток:
+# число вариантов удаления растет как куб длины слова
+FUZZY_MAX_WORD_LENGTH = 30
+FUZZY_MAX_WORDS = 6
+
+# Допустимые разделители CSV и размер фрагмента для их определения
+CSV_DELIMITERS = ';,\t'
+CSV_SNIFF_BYTES = 16 * 1024
+
+# Признаки колонок с сертификатами и значения, означающие отсутствие сертификата
+CERT_KEYWORDS = ['sertifikat', 'certificate', 'cert']
+CERT_EMPTY_VALUES = ['', 'nan', 'none', 'null', '-', 'n/a']
+
+# Служебные колонки, которые бот добавляет к данным при загрузке
+CERT_FLAG_COLUMN = 'has_certificate'
+CERT_TEXT_COLUMN = 'certificates_text'
+DERIVED_COLUMNS = {'normalized_name', CERT_FLAG_COLUMN, CERT_TEXT_COLUMN}
+
+# Возможные названия колонок с ФИО, телефоном и никнеймом студента
+NAME_COLUMNS = ['F.I.Sh', 'ФИО', 'Name', 'Имя', 'Full Name']
+PHONE_COLUMNS = ['Telefon nomeri', 'Phone', 'Телефон']
+NICKNAME_COLUMNS = ['Nick name', 'Nickname', 'Никнейм']
+
+# Пул потоков для поиска и форматирования: число потоков, лимит ожидающих
+# задач, таймаут одной операции (сек) и число одновременно обрабатываемых обновлений
+WORKER_THREADS = int(os.environ.get('WORKER_THREADS', 4))
+WORKER_QUEUE_LIMIT = int(os.environ.get('WORKER_QUEUE_LIMIT', 32))
+WORKER_TIMEOUT = float(os.environ.get('WORKER_TIMEOUT', 10))
+CONCURRENT_UPDATES = int(os.environ.get('CONCURRENT_UPDATES', 32))
+
+# Режим процессов-обработчиков: число процессов (0 — только потоки) и каталог
+# поколоночного снимка данных, который процессы отображают в память
+WORKER_PROCESSES = int(os.environ.get('WORKER_PROCESSES', 0))
+ROSTER_DIR = os.environ.get('ROSTER_DIR') or ('/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir())
+# Тот же формат у локального снимка SNAPSHOT_FILE; номер формата меняется
+# при любом изменении раскладки файла
+ROSTER_MAGIC = b'STUDENTBOT-ROSTER\n'
+ROSTER_VERSION = 1
+
+# Максимальное число студентов в ответе на поиск
+MAX_SEARCH_RESULTS = 5
+
+# Число студентов на одной странице списка группы
+GROUP_PAGE_SIZE = 20
+
+# Проверка списка имен: максимум имен в одном списке, совпадений на имя,
+# сообщений в ответе (больше — ответ CSV-файлом) и размер файла со списком (байт)
+BULK_MAX_NAMES = int(os.environ.get('BULK_MAX_NAMES', 500))
+BULK_MATCHES_PER_NAME = MAX_SEARCH_RESULTS
+BULK_MAX_MESSAGES = int(os.environ.get('BULK_MAX_MESSAGES', 3))
+BULK_MAX_FILE_SIZE = 256 * 1024
+# Нумерация и маркеры списка в начале строки: "1.", "2)", "-", "•"
+LIST_MARKER = re.compile(r'^\s*(?:\d+\s*[.)]|[-•*–])\s*')
+
+# Максимальная длина одного сообщения Telegram
+MESSAGE_LIMIT = 4096
+
+# Фильтры /filter: максимум карточек в ответе, названия условий и значения да/нет
+FILTER_MAX_RESULTS = 20
+FILTER_KEYS = {'group': 'group', 'cert': 'cert', 'phone': 'phone', 'nick': 'nickname', 'nickname': 'nickname'}
+FILTER_YES = {'yes', '1', 'да', 'ha'}
+FILTER_NO = {'no', '0', 'нет', "yo'q", 'yoq'}
+
+# Кэш результатов поиска: максимум запросов, время жизни найденных
+# и ненайденных результатов (сек)
+SEARCH_CACHE_SIZE = int(os.environ.get('SEARCH_CACHE_SIZE', 4096))
+SEARCH_CACHE_TTL = float(os.environ.get('SEARCH_CACHE_TTL', 600))
+SEARCH_NEGATIVE_TTL = float(os.environ.get('SEARCH_NEGATIVE_TTL', 60))
+
+# Максимум готовых карточек студентов (студент и язык) в кэше
+CARD_CACHE_SIZE = int(os.environ.get('CARD_CACHE_SIZE', 10000))
+
+# Inline-режим: максимум результатов, время жизни кэша по префиксу в боте (сек)
+# и время кэширования ответа на стороне Telegram (сек)
+INLINE_RESULTS_LIMIT = 20
+INLINE_CACHE_TTL = float(os.environ.get('INLINE_CACHE_TTL', 30))
+INLINE_CACHE_SIZE = 2048
+INLINE_TELEGRAM_CACHE_TIME = 10
+
+# Входящие запросы: частота (в секунду) и запас для всплеска на пользователя;
+# для inline-запросов, приходящих при каждом нажатии клавиши, лимит отдельный
+USER_RATE = float(os.environ.get('USER_RATE', 1))
+USER_BURST = float(os.environ.get('USER_BURST', 5))
+INLINE_RATE = float(os.environ.get('INLINE_RATE', 5))
+INLINE_BURST = float(os.environ.get('INLINE_BURST', 20))
+
+# Исходящие запросы к Bot API: общий лимит (запросов в секунду), лимит
+# группового чата (сообщений в минуту) и число повторов после RetryAfter
+OUTGOING_GLOBAL_RATE = 30
+OUTGOING_GROUP_CHAT_RATE = 20
+OUTGOING_MAX_RETRIES = 3
+
+# Хранение языковых настроек пользователей: 'sqlite' или 'json'
+USER_LANGUAGE_STORE = os.environ.get('USER_LANGUAGE_STORE', 'sqlite')
+USER_LANGUAGE_DB = os.environ.get('USER_LANGUAGE_DB', 'user_languages.db')
+# JSON-файл настроек (основное хранилище в режиме 'json', источник переноса в режиме 'sqlite')
 USER_LANGUAGE_FILE = "user_languages.json"
+# Интервал фоновой записи изменений настроек (сек)
+PREFERENCES_FLUSH_INTERVAL = float(os.environ.get('PREFERENCES_FLUSH_INTERVAL', 5))
 
 # Многоязычная поддержка
 LANGUAGES = {
@@ -67,6 +250,9 @@ LANGUAGES = {
 🌐 Сменить язык - переключение между языками
 
 Для поиска просто введите имя и фамилию студента.
+Чтобы проверить сразу нескольких студентов, отправьте список имен
+(по одному в строке) или файл .txt/.csv.
+Отбор по группе, сертификатам, телефону и никнейму — команда /filter.
         ''',
         'total_students': 'Всего студентов: {count}',
         'passed_exam_count': 'Сдали экзамен: {count}',
@@ -75,7 +261,28 @@ LANGUAGES = {
         'status': 'Статус',
         'select_language': 'Выберите язык:',
         'has_certificate': 'есть сертификат',
-        'no_certificate': 'нет сертификата'
+        'no_certificate': 'нет сертификата',
+        'busy': '⏳ Бот сейчас перегружен, попробуйте еще раз через несколько секунд',
+        'loading': '⏳ Бот только что запустился и загружает данные студентов, повторите запрос через несколько секунд',
+        'page': 'Страница {page}/{pages}',
+        'rate_limited': '⏳ Слишком много запросов, подождите немного',
+        'bulk_header': '📋 Найдено {found} из {total}',
+        'bulk_not_found': '❌ не найден',
+        'bulk_more': '… и еще {count}',
+        'bulk_truncated': '⚠️ Проверены только первые {limit} имен',
+        'bulk_file_error': '❌ Отправьте список имен файлом .txt или .csv размером до {size} КБ',
+        'bulk_csv_header': 'Запрос;ФИО;Группа;Статус;Телефон;Никнейм;Сертификаты',
+        'filter_found': '🔎 Найдено студентов: {count}',
+        'filter_truncated': 'Показаны первые {limit}, уточните фильтр',
+        'filter_usage': '''Фильтр студентов: /filter условие=значение ...
+
+group=D2 — группа (несколько через запятую: group=D1,D2)
+cert=yes / cert=no — есть ли сертификат
+cert=IELTS — сертификат заданного типа (cert=IELTS,CEFR — любой из них)
+phone=yes / phone=no — указан ли телефон
+nick=yes / nick=no — указан ли никнейм
+
+Пример: /filter group=D2 cert=no'''
     },
     'uz': {
         'welcome': '👋 Talabalar qidiruv botiga xush kelibsiz!\n\nAmalni tanlang:',
@@ -105,6 +312,9 @@ LANGUAGES = {
 🌐 Tilni o\'zgartirish - tillar o\'rtasida almashtirish
 
 Qidirish uchun talabaning ism va familiyasini kiriting.
+Bir nechta talabani birdaniga tekshirish uchun ismlar ro\'yxatini
+(har qatorda bittadan) yoki .txt/.csv faylini yuboring.
+Guruh, sertifikat, telefon va taxallus bo\'yicha saralash — /filter buyrug\'i.
         ''',
         'total_students': 'Jami talabalar: {count}',
         'passed_exam_count': 'Imtihon topshirganlar: {count}',
@@ -113,7 +323,28 @@ Qidirish uchun talabaning ism va familiyasini kiriting.
         'status': 'Holat',
         'select_language': 'Tilni tanlang:',
         'has_certificate': 'sertifikat bor',
-        'no_certificate': 'sertifikat yo\'q'
+        'no_certificate': 'sertifikat yo\'q',
+        'busy': '⏳ Bot hozir band, bir necha soniyadan so\'ng qayta urinib ko\'ring',
+        'loading': '⏳ Bot endigina ishga tushdi va talabalar ma\'lumotlarini yuklamoqda, bir necha soniyadan so\'ng qayta urinib ko\'ring',
+        'page': 'Sahifa {page}/{pages}',
+        'rate_limited': '⏳ So\'rovlar juda ko\'p, biroz kuting',
+        'bulk_header': '📋 {total} tadan {found} tasi topildi',
+        'bulk_not_found': '❌ topilmadi',
+        'bulk_more': '… yana {count} ta',
+        'bulk_truncated': '⚠️ Faqat birinchi {limit} ta ism tekshirildi',
+        'bulk_file_error': '❌ Ismlar ro\'yxatini {size} KB gacha bo\'lgan .txt yoki .csv faylida yuboring',
+        'bulk_csv_header': 'So\'rov;F.I.Sh;Guruh;Holat;Telefon;Taxallus;Sertifikatlar',
+        'filter_found': '🔎 Topilgan talabalar: {count}',
+        'filter_truncated': 'Birinchi {limit} tasi ko\'rsatildi, filtrni aniqlashtiring',
+        'filter_usage': '''Talabalar filtri: /filter shart=qiymat ...
+
+group=D2 — guruh (bir nechtasi vergul bilan: group=D1,D2)
+cert=yes / cert=no — sertifikat bormi
+cert=IELTS — berilgan turdagi sertifikat (cert=IELTS,CEFR — ulardan istalgani)
+phone=yes / phone=no — telefon ko\'rsatilganmi
+nick=yes / nick=no — taxallus ko\'rsatilganmi
+
+Misol: /filter group=D2 cert=no'''
     },
     'en': {
         'welcome': '👋 Welcome to the Student Search Bot!\n\nChoose an action:',
@@ -143,6 +374,9 @@ Qidirish uchun talabaning ism va familiyasini kiriting.
 🌐 Change language - switch between languages
 
 To search, simply enter the student's name and surname.
+To check several students at once, send a list of names
+(one per line) or a .txt/.csv file.
+To filter by group, certificates, phone and nickname, use /filter.
         ''',
         'total_students': 'Total students: {count}',
         'passed_exam_count': 'Passed exam: {count}',
@@ -151,33 +385,1735 @@ To search, simply enter the student's name and surname.
         'status': 'Status',
         'select_language': 'Select language:',
         'has_certificate': 'has certificate',
-        'no_certificate': 'no certificate'
+        'no_certificate': 'no certificate',
+        'busy': '⏳ The bot is busy right now, please try again in a few seconds',
+        'loading': '⏳ The bot has just started and is loading student data, please try again in a few seconds',
+        'page': 'Page {page}/{pages}',
+        'rate_limited': '⏳ Too many requests, please wait a moment',
+        'bulk_header': '📋 Found {found} of {total}',
+        'bulk_not_found': '❌ not found',
+        'bulk_more': '… and {count} more',
+        'bulk_truncated': '⚠️ Only the first {limit} names were checked',
+        'bulk_file_error': '❌ Send the list of names as a .txt or .csv file up to {size} KB',
+        'bulk_csv_header': 'Query;Full name;Group;Status;Phone;Nickname;Certificates',
+        'filter_found': '🔎 Students found: {count}',
+        'filter_truncated': 'Showing the first {limit}, narrow the filter',
+        'filter_usage': '''Student filter: /filter condition=value ...
+
+group=D2 — group (several separated by commas: group=D1,D2)
+cert=yes / cert=no — has a certificate
+cert=IELTS — certificate of the given type (cert=IELTS,CEFR — any of them)
+phone=yes / phone=no — phone is set
+nick=yes / nick=no — nickname is set
+
+Example: /filter group=D2 cert=no'''
     }
 }
 
-class StudentBot:
-    def __init__(self):
-        self.students_data = {}
-        self.user_languages = self.load_user_languages()
-        self.load_data()
+def trace_search(query: str, normalized_query: str, trace: Dict, results: int, elapsed_ms: float):
+    """Запись трассировки одного поискового запроса
+    
+    Медленные запросы пишутся всегда с уровнем WARNING, остальные —
+    с уровнем DEBUG для доли SEARCH_TRACE_SAMPLE_RATE запросов.
+    """
+    if elapsed_ms >= SEARCH_SLOW_MS:
+        level = logging.WARNING
+    elif search_logger.isEnabledFor(logging.DEBUG) and random.random() < SEARCH_TRACE_SAMPLE_RATE:
+        level = logging.DEBUG
+    else:
+        return
+    
+    span = {
+        'query': query,
+        'normalized_query': normalized_query,
+        'rows_scanned': trace.get('scanned', 0),
+        'matches': {quality: trace.get(quality, 0) for quality in SearchIndex.QUALITY_ORDER},
+        'results': results,
+        'elapsed_ms': round(elapsed_ms, 3)
+    }
+    search_logger.log(
+        level,
+        "search query=%r scanned=%d high=%d medium=%d low=%d translit=%d fuzzy=%d "
+        "results=%d elapsed_ms=%.3f",
+        normalized_query, span['rows_scanned'], span['matches']['high'],
+        span['matches']['medium'], span['matches']['low'], span['matches']['translit'],
+        span['matches']['fuzzy'], results, elapsed_ms,
+        extra={'span': span}
+    )
+
+
+# Транслитерация кириллицы (русский и узбекский алфавиты) в латиницу
+TRANSLIT_TABLE = str.maketrans({
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ё': 'yo',
+    'ж': 'j', 'з': 'z', 'и': 'i', 'й': 'y', 'к': 'k', 'л': 'l', 'м': 'm',
+    'н': 'n', 'о': 'o', 'п': 'p', 'р': 'r', 'с': 's', 'т': 't', 'у': 'u',
+    'ф': 'f', 'х': 'x', 'ц': 'ts', 'ч': 'ch', 'ш': 'sh', 'щ': 'sh', 'ъ': '',
+    'ы': 'i', 'ь': '', 'э': 'e', 'ю': 'yu', 'я': 'ya', 'ў': 'o', 'қ': 'q',
+    'ғ': 'g', 'ҳ': 'h',
+    # Апострофы узбекской латиницы (o', g') не различаем
+    "'": '', '`': '', 'ʻ': '', 'ʼ': '', '‘': '', '’': ''
+})
+# Разные латинские записи одного звука
+TRANSLIT_REPLACEMENTS = [('kh', 'x'), ('zh', 'j'), ('dj', 'j'), ('q', 'k'), ('w', 'v')]
+
+
+def transliterate(text: str) -> str:
+    """Приведение нормализованного текста к единой латинской записи"""
+    text = text.translate(TRANSLIT_TABLE)
+    for old, new in TRANSLIT_REPLACEMENTS:
+        text = text.replace(old, new)
+    return text
+
+
+def allowed_typos(word: str) -> int:
+    """Допустимое число опечаток в слове запроса в зависимости от длины"""
+    if len(word) <= 3 or len(word) > FUZZY_MAX_WORD_LENGTH:
+        return 0
+    if len(word) <= 7:
+        return 1
+    return FUZZY_MAX_DISTANCE
+
+
+def word_starts(text: str) -> List[int]:
+    """Позиции начала слов в тексте"""
+    return [i for i, char in enumerate(text) if char != ' ' and (i == 0 or text[i - 1] == ' ')]
+
+
+def word_deletes(word: str, distance: int) -> set:
+    """Все варианты слова с удалением до distance символов (SymSpell)"""
+    result = {word}
+    frontier = {word}
+    for _ in range(distance):
+        frontier = {w[:i] + w[i + 1:] for w in frontier for i in range(len(w))}
+        result |= frontier
+    return result
+
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+    """Расстояние Дамерау-Левенштейна с отсечением по limit (limit + 1 — больше limit)"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous2 = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if (previous2 is not None and i > 1 and j > 1
+                    and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]):
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+        previous2, previous = previous, current
+    return min(previous[-1], limit + 1)
+
+
+def candidate_docs(words: List[str], postings, ngrams, total: int):
+    """Документы, в тексте которых есть все n-граммы слов запроса
+    
+    Каждая n-грамма слова обязана встретиться в тексте подходящего
+    документа, поэтому проверять нужно только пересечение их списков.
+    Пересечение считается векторно, начиная с самого редкого списка;
+    документы возвращаются по возрастанию номера.
+    """
+    grams = set()
+    for word in words:
+        grams |= ngrams(word)
+
+    if not grams:
+        # Все слова короче n-граммы: проверяем все документы
+        return range(total)
+
+    lists = []
+    for gram in grams:
+        ids = postings.get(gram)
+        if ids is None:
+            return ()
+        lists.append(ids)
+    lists.sort(key=len)
+
+    candidates = np.frombuffer(lists[0], dtype=np.uint32)
+    for ids in lists[1:]:
+        if not len(candidates):
+            break
+        present = np.zeros(total, dtype=np.bool_)
+        present[np.frombuffer(ids, dtype=np.uint32)] = True
+        candidates = candidates[present[candidates]]
+    return candidates.tolist()
+
+
+class AhoCorasick:
+    """Автомат Ахо — Корасик: поиск всех образцов в тексте за один проход"""
+
+    def __init__(self, patterns: List[str]):
+        # Бор образцов: переходы, суффиксные ссылки и номера образцов,
+        # заканчивающихся в узле (включая найденные по суффиксным ссылкам)
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [()]
+        for pattern_id, pattern in enumerate(patterns):
+            node = 0
+            for char in pattern:
+                next_node = self.goto[node].get(char)
+                if next_node is None:
+                    next_node = len(self.goto)
+                    self.goto[node][char] = next_node
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append(())
+                node = next_node
+            self.output[node] += (pattern_id,)
+
+        # Суффиксные ссылки строим обходом в ширину
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, next_node in self.goto[node].items():
+                queue.append(next_node)
+                fail = self.fail[node]
+                while fail and char not in self.goto[fail]:
+                    fail = self.fail[fail]
+                self.fail[next_node] = self.goto[fail].get(char, 0)
+                self.output[next_node] += self.output[self.fail[next_node]]
+
+    def find(self, text: str) -> set:
+        """Номера образцов, встречающихся в тексте"""
+        goto, fail, output = self.goto, self.fail, self.output
+        found = set()
+        node = 0
+        for char in text:
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            if output[node]:
+                found.update(output[node])
+        return found
+
+
+def split_name_list(text: str) -> List[str]:
+    """Непустые строки списка имен без нумерации и маркеров"""
+    lines = (LIST_MARKER.sub('', line).strip() for line in text.splitlines())
+    return [line for line in lines if line]
+
+
+def split_message(blocks: List[str], limit: int = MESSAGE_LIMIT) -> List[str]:
+    """Склеивание блоков текста в сообщения не длиннее limit
+    
+    Блок переносится в следующее сообщение целиком; блок длиннее
+    лимита режется на части.
+    """
+    messages = []
+    current = ''
+    for block in blocks:
+        while len(block) > limit:
+            if current:
+                messages.append(current)
+                current = ''
+            messages.append(block[:limit])
+            block = block[limit:]
+        if current and len(current) + 1 + len(block) > limit:
+            messages.append(current)
+            current = ''
+        current = f"{current}\n{block}" if current else block
+    if current:
+        messages.append(current)
+    return messages
+
+
+def load_group_registry() -> Dict[str, Dict]:
+    """Реестр групп из переменной GROUPS или файла GROUPS_CONFIG
+    
+    Формат — JSON-список (или {"groups": [...]}) объектов вида
+    {"name": "D1", "url": "...", "columns": {"name": "F.I.Sh"}}, где columns
+    необязательно и задает колонки ролей name, phone, nickname, certificates
+    (строкой или списком). Без настройки используются группы GROUP_URLS.
+    """
+    source = 'GROUPS'
+    raw = os.environ.get('GROUPS', '')
+    if not raw and GROUPS_CONFIG and os.path.exists(GROUPS_CONFIG):
+        source = GROUPS_CONFIG
+        with open(GROUPS_CONFIG, encoding='utf-8') as f:
+            raw = f.read()
+    if not raw:
+        return {name: {'url': url, 'columns': {}} for name, url in GROUP_URLS.items()}
+    
+    config = json.loads(raw)
+    entries = config['groups'] if isinstance(config, dict) else config
+    registry = {}
+    for entry in entries:
+        name = str(entry['name']).strip()
+        # callback_data кнопки ("group_<имя>:<страница>") ограничена 64 байтами
+        if not name or ':' in name or len(f"group_{name}:9999".encode()) > 64:
+            raise ValueError(f"{source}: недопустимое имя группы {name!r}")
+        if name in registry:
+            raise ValueError(f"{source}: группа {name} указана дважды")
+        columns = {}
+        for role, value in (entry.get('columns') or {}).items():
+            if role not in COLUMN_ROLES:
+                raise ValueError(f"{source}: неизвестная роль колонки {role!r} в группе {name}")
+            columns[role] = [value] if isinstance(value, str) else list(value)
+        registry[name] = {'url': entry['url'], 'columns': columns}
+    
+    if not registry:
+        raise ValueError(f"{source}: не задано ни одной группы")
+    return registry
+
+
+GROUP_REGISTRY = load_group_registry()
+
+
+def first_filled(df: pd.DataFrame, columns: List[str], skip_blank: bool) -> pd.Series:
+    """Первое заполненное значение из колонок-кандидатов для каждой строки
+    
+    Значения приводятся к строке без пробелов по краям; при skip_blank
+    пустые строки пропускаются. Если значения нет, в строке будет None.
+    """
+    result = pd.Series(None, index=df.index, dtype=object)
+    for col in columns:
+        if col not in df.columns:
+            continue
+        values = df[col].astype(str).str.strip().where(df[col].notna())
+        if skip_blank:
+            values = values.where(values != '')
+        result = result.where(result.notna(), values)
+    return result
+
+
+def student_names(df: pd.DataFrame, columns: List[str] = NAME_COLUMNS) -> pd.Series:
+    """ФИО студентов группы"""
+    names = first_filled(df, columns, skip_blank=False)
+    # Если не нашли по названию колонки, берем вторую колонку (обычно там имя)
+    if len(df.columns) > 1:
+        fallback = df.iloc[:, 1]
+        names = names.where(names.notna(), fallback.astype(str).str.strip().where(fallback.notna()))
+    return names.fillna("Не указано")
+
+
+def release_memory():
+    """Возврат системе памяти, освобожденной прошлой версией данных
+    
+    glibc оставляет освобожденную память в куче процесса; malloc_trim
+    отдает ее системе. На других libc ничего не делает.
+    """
+    try:
+        ctypes.CDLL(None).malloc_trim(0)
+    except (OSError, AttributeError, TypeError):
+        pass
+
+
+class Student:
+    """Запись о студенте для форматирования ответов
+    
+    Поля читаются из хранилища при обращении: поиск возвращает записи
+    всех совпадений, а показываются только первые из них.
+    """
+
+    __slots__ = ('store', 'doc_id', 'group', 'index')
+
+    def __init__(self, store: 'StudentStore', doc_id: int, group: str, index):
+        self.store = store
+        self.doc_id = doc_id
+        self.group = group
+        self.index = index
+
+    @property
+    def name(self) -> str:
+        return self.store.names[self.doc_id]
+
+    @property
+    def phone(self) -> str:
+        return self.store.phones[self.doc_id]
+
+    @property
+    def nickname(self) -> str:
+        return self.store.nicknames[self.doc_id]
+
+    @property
+    def certificates(self) -> str:
+        return self.store.certificates[self.doc_id]
+
+    @property
+    def has_certificate(self) -> bool:
+        return bool(self.store.cert_flags[self.doc_id])
+
+
+class StudentStore:
+    """Компактное поколоночное хранилище студентов всех групп
+    
+    Колонки с ФИО, телефоном, никнеймом и сертификатами определяются один
+    раз при построении, поэтому поиск и форматирование не обращаются к
+    pandas. Номер студента в хранилище совпадает с номером документа
+    в поисковом индексе.
+    """
+
+    def __init__(self, students_data: Dict[str, pd.DataFrame], columns: Optional[Dict[str, List]] = None):
+        columns = columns or {}
+        self.group_names = []   # группы в порядке хранения
+        self.group_starts = []  # номер первого студента каждой группы
+        self.indexes = array('q')
+        self.names = []
+        self.phones = []
+        self.nicknames = []
+        self.certificates = []
+        self.cert_flags = bytearray()
+        self.other_fields = []  # остальные значения строки, которых нет в полях выше
+
+        for group, df in students_data.items():
+            if df.empty:
+                continue
+            self.group_names.append(sys.intern(group))
+            self.group_starts.append(len(self.names))
+            self.indexes.extend(int(index) for index in df.index)
+            names = student_names(df, columns.get('name', NAME_COLUMNS)).tolist()
+            phones = first_filled(df, columns.get('phone', PHONE_COLUMNS), skip_blank=True).fillna('').tolist()
+            nicknames = first_filled(df, columns.get('nickname', NICKNAME_COLUMNS), skip_blank=True).fillna('').tolist()
+            # Тексты сертификатов часто повторяются: храним по одному экземпляру
+            certificates = [sys.intern(text) for text in df[CERT_TEXT_COLUMN].tolist()]
+            self.names.extend(names)
+            self.phones.extend(phones)
+            self.nicknames.extend(nicknames)
+            self.certificates.extend(certificates)
+            self.cert_flags.extend(df[CERT_FLAG_COLUMN].to_numpy(dtype=bool).tobytes())
+            # Поиск по всей строке видит и колонки без роли (номер, второе ФИО и т.п.)
+            fields = df.drop(columns=list(DERIVED_COLUMNS), errors='ignore').to_numpy(dtype=object)
+            for values, name, phone, nickname, certs in zip(fields, names, phones, nicknames, certificates):
+                known = {name, phone, nickname, *certs.split(', ')}
+                self.other_fields.append(' '.join(
+                    text for text in (str(value).strip() for value in values if pd.notna(value))
+                    if text and text not in known
+                ))
+        # Имена, телефоны, никнеймы и прочие поля почти все разные: храним их
+        # одним блоком UTF-8 со смещениями, без объекта строки на студента
+        self.names = pack_strings(self.names)
+        self.phones = pack_strings(self.phones)
+        self.nicknames = pack_strings(self.nicknames)
+        self.other_fields = pack_strings(self.other_fields)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def group_range(self, group: str) -> range:
+        """Номера студентов группы"""
+        if group not in self.group_names:
+            return range(0)
+        position = self.group_names.index(group)
+        stop = self.group_starts[position + 1] if position + 1 < len(self.group_starts) else len(self.names)
+        return range(self.group_starts[position], stop)
+
+    def to_roster(self, writer: 'RosterWriter') -> Dict:
+        """Запись колонок в поколоночный снимок; возвращает их описание"""
+        return {
+            'group_names': self.group_names,
+            'group_starts': self.group_starts,
+            'indexes': writer.array('q', self.indexes),
+            'names': writer.strings(self.names),
+            'phones': writer.strings(self.phones),
+            'nicknames': writer.strings(self.nicknames),
+            'certificates': writer.strings(self.certificates),
+            'other_fields': writer.strings(self.other_fields),
+            'cert_flags': writer.array('B', self.cert_flags)
+        }
+
+    @classmethod
+    def from_roster(cls, descriptor: Dict, roster: 'RosterFile') -> 'StudentStore':
+        """Хранилище поверх отображенного в память снимка, без копирования"""
+        store = cls.__new__(cls)
+        store.group_names = descriptor['group_names']
+        store.group_starts = descriptor['group_starts']
+        store.indexes = roster.array(descriptor['indexes'])
+        for field in ('names', 'phones', 'nicknames', 'certificates', 'other_fields'):
+            setattr(store, field, roster.strings(descriptor[field]))
+        store.cert_flags = roster.array(descriptor['cert_flags'])
+        return store
+
+    def student(self, doc_id: int) -> Student:
+        group = self.group_names[bisect_right(self.group_starts, doc_id) - 1]
+        return Student(self, doc_id, group, self.indexes[doc_id])
+
+
+def certificate_types(text: str) -> set:
+    """Типы сертификатов в тексте: первое слово каждой записи ("IELTS 6.5" -> IELTS)"""
+    types = set()
+    for part in text.split(','):
+        match = re.match(r'[^\W\d_]+', part.strip())
+        if match:
+            types.add(match.group().upper())
+    return types
+
+
+def parse_filter(args: List[str]) -> Dict[str, List[str]]:
+    """Разбор условий /filter вида key=value[,value...]
+    
+    Возвращает условие -> значения; при ошибке поднимает ValueError.
+    """
+    conditions = {}
+    for arg in args:
+        key, sep, value = arg.partition('=')
+        key = FILTER_KEYS.get(key.strip().lower())
+        values = [item.strip() for item in value.split(',') if item.strip()]
+        if not sep or key is None or not values:
+            raise ValueError(arg)
+        if key in ('phone', 'nickname'):
+            values = [item.lower() for item in values]
+            if any(item not in FILTER_YES | FILTER_NO for item in values):
+                raise ValueError(arg)
+        conditions.setdefault(key, []).extend(values)
+    if not conditions:
+        raise ValueError('')
+    return conditions
+
+
+class FilterIndex:
+    """Битовые карты признаков студентов группы для /filter
+    
+    Каждая карта — булев массив NumPy по номерам студентов в хранилище
+    группы, поэтому любое сочетание условий считается векторными
+    И/ИЛИ без перебора студентов.
+    """
+
+    def __init__(self, store: StudentStore):
+        self.size = len(store)
+        self.cert = np.frombuffer(store.cert_flags, dtype=np.bool_, count=self.size)
+        self.phone = np.fromiter((bool(phone) for phone in store.phones), dtype=np.bool_, count=self.size)
+        self.nickname = np.fromiter((bool(nickname) for nickname in store.nicknames), dtype=np.bool_,
+                                    count=self.size)
+        # Тексты сертификатов повторяются: разбираем каждый один раз
+        parsed = {}
+        positions = {}
+        for position, text in enumerate(store.certificates):
+            types = parsed.get(text)
+            if types is None:
+                types = parsed[text] = certificate_types(text)
+            for cert_type in types:
+                positions.setdefault(cert_type, []).append(position)
+        self.cert_types = {}
+        for cert_type, ids in positions.items():
+            bitmap = np.zeros(self.size, dtype=np.bool_)
+            bitmap[ids] = True
+            self.cert_types[cert_type] = bitmap
+
+    def to_roster(self, writer: 'RosterWriter') -> Dict:
+        """Запись карт в поколоночный снимок; карта cert берется из хранилища"""
+        return {
+            'phone': writer.bitmap(self.phone),
+            'nickname': writer.bitmap(self.nickname),
+            'cert_types': {cert_type: writer.bitmap(bitmap) for cert_type, bitmap in self.cert_types.items()}
+        }
+
+    @classmethod
+    def from_roster(cls, descriptor: Dict, store: StudentStore, roster: 'RosterFile') -> 'FilterIndex':
+        """Карты поверх отображенного в память снимка: колонки заново не разбираются"""
+        filters = cls.__new__(cls)
+        filters.size = len(store)
+        filters.cert = np.frombuffer(store.cert_flags, dtype=np.bool_, count=filters.size)
+        filters.phone = roster.bitmap(descriptor['phone'])
+        filters.nickname = roster.bitmap(descriptor['nickname'])
+        filters.cert_types = {
+            cert_type: roster.bitmap(bitmap) for cert_type, bitmap in descriptor['cert_types'].items()
+        }
+        return filters
+
+    def match(self, conditions: Dict[str, List[str]]) -> np.ndarray:
+        """Номера студентов, подходящих под все условия (значения одного условия — ИЛИ)"""
+        mask = np.ones(self.size, dtype=np.bool_)
+        for key, values in conditions.items():
+            if key == 'group':
+                continue
+            bitmaps = getattr(self, key)
+            any_value = np.zeros(self.size, dtype=np.bool_)
+            for value in values:
+                if value.lower() in FILTER_YES:
+                    any_value |= bitmaps
+                elif value.lower() in FILTER_NO:
+                    any_value |= ~bitmaps
+                else:
+                    # Для cert значение может быть типом сертификата
+                    bitmap = self.cert_types.get(value.upper())
+                    if bitmap is not None:
+                        any_value |= bitmap
+            mask &= any_value
+        return np.flatnonzero(mask)
+
+
+class TTLCache:
+    """Ограниченный по размеру кэш с временем жизни записей (LRU-вытеснение)
+    
+    Считает попадания, промахи, вытеснения по размеру и устаревшие записи.
+    """
+
+    def __init__(self, maxsize: int, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def get(self, key, default=None):
+        with self.lock:
+            item = self.data.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+            value, expires = item
+            if expires is not None and expires < time.monotonic():
+                del self.data[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self.data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl: Optional[float] = None):
+        """Сохранить значение; ttl переопределяет время жизни по умолчанию"""
+        ttl = self.ttl if ttl is None else ttl
+        expires = time.monotonic() + ttl if ttl is not None else None
+        with self.lock:
+            self.data[key] = (value, expires)
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self) -> Dict[str, int]:
+        """Счетчики кэша для мониторинга"""
+        return {
+            'size': len(self.data),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations
+        }
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+
+class StringColumn:
+    """Столбец строк: UTF-8 байты подряд (в памяти или в отображенном файле) и смещения
+    
+    Поддерживает len(), индексацию и перебор, поэтому подменяет список
+    строк в индексе и хранилище (в том числе для bisect).
+    """
+
+    def __init__(self, data, start: int, offsets):
+        # Срез mmap сразу дает bytes: это быстрее, чем срез memoryview
+        self.data = data
+        self.start = start
+        self.offsets = offsets
+        self.count = len(offsets) - 1
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __getitem__(self, position: int) -> str:
+        if position < 0:
+            position += self.count
+            if position < 0:
+                raise IndexError(position)
+        # Номер за концом столбца отсекает само обращение к смещениям
+        start, offsets = self.start, self.offsets
+        return self.data[start + offsets[position]:start + offsets[position + 1]].decode('utf-8', 'surrogatepass')
+
+    def __iter__(self):
+        return iter(self.take(range(self.count)))
+
+    @property
+    def nbytes(self) -> int:
+        """Объем строк и смещений в байтах"""
+        return self.offsets[-1] + memoryview(self.offsets).nbytes
+
+    def take(self, positions) -> List[str]:
+        """Строки с заданными номерами (неотрицательными) одним списком"""
+        data, start, offsets = self.data, self.start, self.offsets
+        return [data[start + offsets[position]:start + offsets[position + 1]].decode('utf-8', 'surrogatepass')
+                for position in positions]
+
+
+def pack_strings(texts) -> StringColumn:
+    """Столбец строк в памяти: один блок байтов вместо объекта на каждую строку"""
+    encoded = [str(text).encode('utf-8', 'surrogatepass') for text in texts]
+    offsets = array('I', [0])
+    total = 0
+    for text in encoded:
+        total += len(text)
+        offsets.append(total)
+    return StringColumn(b''.join(encoded), 0, offsets)
+
+
+class MappedTable:
+    """Словарь строка -> список чисел в отображенном в память файле
+    
+    Ключи отсортированы и ищутся делением пополам. Если задан words,
+    значения — номера строк в нем (так хранятся удаления для опечаток).
+    """
+
+    def __init__(self, keys: StringColumn, offsets: memoryview, values: memoryview,
+                 words: Optional[StringColumn] = None):
+        self.keys = keys
+        self.offsets = offsets
+        self.values = values
+        self.words = words
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def __contains__(self, key: str) -> bool:
+        return self.position(key) is not None
+
+    def __getitem__(self, key: str):
+        values = self.get(key)
+        if values is None:
+            raise KeyError(key)
+        return values
+
+    @property
+    def nbytes(self) -> int:
+        return self.keys.nbytes + self.offsets.nbytes + self.values.nbytes
+
+    def position(self, key: str) -> Optional[int]:
+        position = bisect_left(self.keys, key)
+        if position < len(self.keys) and self.keys[position] == key:
+            return position
+        return None
+
+    def get(self, key: str, default=None):
+        position = self.position(key)
+        if position is None:
+            return default
+        values = self.values[self.offsets[position]:self.offsets[position + 1]]
+        if self.words is not None:
+            return [self.words[value] for value in values]
+        return values
+
+
+class RosterWriter:
+    """Запись поколоночного снимка: массивы подряд с выравниванием по 8 байт"""
+
+    def __init__(self):
+        self.chunks = []
+        self.size = 0
+
+    def add(self, data: bytes) -> List[int]:
+        padding = -self.size % 8
+        if padding:
+            self.chunks.append(bytes(padding))
+            self.size += padding
+        location = [self.size, len(data)]
+        self.chunks.append(data)
+        self.size += len(data)
+        return location
+
+    def array(self, typecode: str, values) -> Dict:
+        # Массив из отображенного файла (индекс, загруженный из снимка) копируется как есть
+        if isinstance(values, memoryview) and values.format == typecode:
+            return {'type': typecode, 'at': self.add(values.tobytes())}
+        return {'type': typecode, 'at': self.add(array(typecode, values).tobytes())}
+
+    def bitmap(self, values: np.ndarray) -> Dict:
+        return {'type': 'B', 'at': self.add(values.astype(np.bool_).tobytes())}
+
+    def strings(self, texts) -> Dict:
+        column = texts if isinstance(texts, StringColumn) else pack_strings(texts)
+        data = column.data[column.start:column.start + column.offsets[-1]]
+        return {'data': self.add(data), 'offsets': self.array('Q', column.offsets)}
+
+    def table(self, mapping: Dict, words: Optional[Dict[str, int]] = None) -> Dict:
+        """Словарь с отсортированными ключами; words — номера строк для значений-строк"""
+        if isinstance(mapping, MappedTable):
+            return {'keys': self.strings(mapping.keys), 'offsets': self.array('Q', mapping.offsets),
+                    'values': self.array('I', mapping.values)}
+        keys = sorted(mapping)
+        offsets = array('Q', [0])
+        values = array('I')
+        for key in keys:
+            if words is None:
+                values.extend(mapping[key])
+            else:
+                values.extend(words[word] for word in mapping[key])
+            offsets.append(len(values))
+        return {'keys': self.strings(keys), 'offsets': self.array('Q', offsets), 'values': self.array('I', values)}
+
+    def write(self, path: str, header: Dict):
+        """Атомарная запись файла: заголовок JSON, затем массивы"""
+        encoded = json.dumps(header).encode()
+        encoded += b' ' * (-(len(ROSTER_MAGIC) + 12 + len(encoded)) % 8)
+        temp_file = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(temp_file, 'wb') as f:
+                f.write(ROSTER_MAGIC)
+                f.write(ROSTER_VERSION.to_bytes(4, 'big'))
+                f.write(len(encoded).to_bytes(8, 'big'))
+                f.write(encoded)
+                for chunk in self.chunks:
+                    f.write(chunk)
+            os.replace(temp_file, path)
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.remove(temp_file)
+            raise
+
+
+class RosterFile:
+    """Поколоночный снимок данных, отображенный в память только для чтения
+    
+    Все процессы-обработчики отображают один и тот же файл, поэтому
+    данные хранятся в памяти один раз, без копий DataFrame в процессах.
+    """
+
+    def __init__(self, path: str):
+        with open(path, 'rb') as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self.mmap)
+        if bytes(view[:len(ROSTER_MAGIC)]) != ROSTER_MAGIC:
+            raise ValueError(f"Файл {path} не является снимком данных")
+        version_end = len(ROSTER_MAGIC) + 4
+        version = int.from_bytes(view[len(ROSTER_MAGIC):version_end], 'big')
+        if version != ROSTER_VERSION:
+            raise ValueError(f"Снимок {path} другого формата ({version}, ожидается {ROSTER_VERSION})")
+        header_start = version_end + 8
+        header_size = int.from_bytes(view[version_end:header_start], 'big')
+        self.header = json.loads(bytes(view[header_start:header_start + header_size]))
+        self.data_start = header_start + header_size
+        self.view = view[self.data_start:]
+        self.path = path
+
+    def array(self, descriptor: Dict) -> memoryview:
+        start, size = descriptor['at']
+        return self.view[start:start + size].cast(descriptor['type'])
+
+    def bitmap(self, descriptor: Dict) -> np.ndarray:
+        return np.frombuffer(self.array(descriptor), dtype=np.bool_)
+
+    def strings(self, descriptor: Dict) -> StringColumn:
+        return StringColumn(self.mmap, self.data_start + descriptor['data'][0], self.array(descriptor['offsets']))
+
+    def table(self, descriptor: Dict, words: Optional[StringColumn] = None) -> MappedTable:
+        return MappedTable(self.strings(descriptor['keys']), self.array(descriptor['offsets']),
+                           self.array(descriptor['values']), words)
+
+
+class SearchIndex:
+    """Инвертированный индекс по триграммам для поиска студентов
+    
+    Помимо точных уровней high/medium/low индекс отвечает на нечеткие
+    запросы: по транслитерированным именам (translit) и по словам имени
+    с опечатками (fuzzy).
+    """
+
+    NGRAM = 3
+    QUALITY_ORDER = {'high': 0, 'medium': 1, 'low': 2, 'translit': 3, 'fuzzy': 4}
+
+    def __init__(self, students_data: Dict[str, pd.DataFrame], columns: Optional[Dict[str, List]] = None):
+        # Имена хранятся только в хранилище: нормализованное имя обычно
+        # совпадает с именем в нижнем регистре, поэтому отдельно хранятся
+        # лишь несовпадающие; транслитерация и текст строки для уровня low
+        # вычисляются при обращении
+        self.store = StudentStore(students_data, columns)
+        self.name_exceptions = {}
+        names = [name for df in students_data.values() if not df.empty for name in df['normalized_name'].tolist()]
+        folded_names = []
+        # Списки документов храним компактно, по 4 байта на вхождение
+        self.postings = {}
+        self.folded_postings = {}
+        self.word_docs = {}
+
+        for doc_id, name in enumerate(names):
+            if name != self.store.names[doc_id].lower():
+                self.name_exceptions[doc_id] = name
+            folded_name = transliterate(name)
+            folded_names.append(folded_name)
+
+            for gram in self.ngrams(self.row_text(doc_id)):
+                self.postings.setdefault(gram, array('I')).append(doc_id)
+            for gram in self.ngrams(folded_name):
+                self.folded_postings.setdefault(gram, array('I')).append(doc_id)
+            for word in set(folded_name.split()):
+                self.word_docs.setdefault(word, array('I')).append(doc_id)
+
+        # Префиксный индекс для поиска по мере набора: записи (документ, начало
+        # слова, запись имени), отсортированные по ключу "имя с этого слова" в
+        # исходной или транслитерированной записи. Сами ключи не хранятся,
+        # а вырезаются из имени при сравнении
+        keys = []
+        docs = array('I')
+        starts = array('I')
+        folded_flags = bytearray()
+        for doc_id, (name, folded_name) in enumerate(zip(names, folded_names)):
+            for folded, text in enumerate((name, folded_name)):
+                for start in word_starts(text):
+                    keys.append(text[start:])
+                    docs.append(doc_id)
+                    starts.append(start)
+                    folded_flags.append(folded)
+        del names, folded_names
+        # Сортировка устойчива: при равных ключах записи идут по номеру документа,
+        # а повтор ключа того же документа в транслитерированной записи отбрасывается
+        self.prefix_docs = array('I')
+        self.prefix_starts = array('I')
+        self.prefix_folded = bytearray()
+        previous = None
+        for entry in sorted(range(len(keys)), key=keys.__getitem__):
+            if (keys[entry], docs[entry]) == previous:
+                continue
+            previous = (keys[entry], docs[entry])
+            self.prefix_docs.append(docs[entry])
+            self.prefix_starts.append(starts[entry])
+            self.prefix_folded.append(folded_flags[entry])
+        del keys, docs, starts, folded_flags
+
+        # Словарь удалений для поиска слов с опечатками
+        deletes = {}
+        for word in self.word_docs:
+            for variant in word_deletes(word, FUZZY_MAX_DISTANCE):
+                deletes.setdefault(variant, []).append(word)
+        self.deletes = deletes
+
+    def __len__(self) -> int:
+        return len(self.store)
+
+    def name(self, doc_id: int) -> str:
+        """Нормализованное имя документа"""
+        name = self.name_exceptions.get(doc_id)
+        return name if name is not None else self.store.names[doc_id].lower()
+
+    def names_of(self, doc_ids) -> List[str]:
+        """Нормализованные имена документов (как name(), но одним проходом)"""
+        name_exceptions = self.name_exceptions
+        return [name_exceptions.get(doc_id, name.lower())
+                for doc_id, name in zip(doc_ids, self.store.names.take(doc_ids))]
+
+    def folded_names_of(self, doc_ids) -> List[str]:
+        """Транслитерированные имена документов
+        
+        Имена транслитерируются одной строкой: вызов на каждое имя
+        заметно дороже самой замены символов.
+        """
+        if not doc_ids:
+            return []
+        return transliterate('\n'.join(self.names_of(doc_ids))).split('\n')
+
+    def row_text(self, doc_id: int) -> str:
+        """Текст строки для уровня low: нормализованное имя и поля студента в нижнем регистре"""
+        store = self.store
+        fields = (store.phones[doc_id], store.nicknames[doc_id], store.certificates[doc_id],
+                  store.other_fields[doc_id])
+        return ' '.join([self.name(doc_id), *(field.lower() for field in fields if field)])
+
+    TABLE_FIELDS = ('postings', 'folded_postings', 'word_docs')
+
+    def to_roster(self, writer: RosterWriter) -> Dict:
+        """Запись индекса в поколоночный снимок; возвращает его описание
+        
+        Удаления для опечаток хранятся номерами слов в ключах word_docs.
+        """
+        descriptor = {field: writer.table(getattr(self, field)) for field in self.TABLE_FIELDS}
+        descriptor['name_exceptions'] = list(self.name_exceptions.items())
+        # У индекса из снимка удаления уже хранятся номерами слов
+        words = None
+        if not isinstance(self.word_docs, MappedTable):
+            words = {word: position for position, word in enumerate(sorted(self.word_docs))}
+        descriptor['deletes'] = writer.table(self.deletes, words)
+        descriptor['prefix_docs'] = writer.array('I', self.prefix_docs)
+        descriptor['prefix_starts'] = writer.array('I', self.prefix_starts)
+        descriptor['prefix_folded'] = writer.array('B', self.prefix_folded)
+        descriptor['store'] = self.store.to_roster(writer)
+        return descriptor
+
+    @classmethod
+    def from_roster(cls, descriptor: Dict, roster: RosterFile) -> 'SearchIndex':
+        """Индекс поверх отображенного в память снимка, без копирования"""
+        index = cls.__new__(cls)
+        index.store = StudentStore.from_roster(descriptor['store'], roster)
+        index.name_exceptions = dict(descriptor['name_exceptions'])
+        for field in cls.TABLE_FIELDS:
+            setattr(index, field, roster.table(descriptor[field]))
+        index.deletes = roster.table(descriptor['deletes'], index.word_docs.keys)
+        index.prefix_docs = roster.array(descriptor['prefix_docs'])
+        index.prefix_starts = roster.array(descriptor['prefix_starts'])
+        index.prefix_folded = roster.array(descriptor['prefix_folded'])
+        return index
+
+    @classmethod
+    def ngrams(cls, text: str) -> set:
+        """Множество n-грамм строки"""
+        return {text[i:i + cls.NGRAM] for i in range(len(text) - cls.NGRAM + 1)}
+
+    def search(self, normalized_query: str, trace: Optional[Dict] = None) -> List[Dict]:
+        """Поиск по нормализованному запросу
+        
+        Сначала идут точные уровни high/medium/low, затем (если включен
+        нечеткий поиск) translit и fuzzy, упорядоченные по числу опечаток.
+        В trace, если он передан, записываются счетчики для трассировки.
+        """
+        query_words = normalized_query.split()
+        tiers = {quality: [] for quality in self.QUALITY_ORDER}
+
+        candidates = candidate_docs(query_words, self.postings, self.ngrams, len(self))
+        for doc_id, name in zip(candidates, self.names_of(candidates)):
+
+            if normalized_query in name:
+                quality = 'high'
+            elif all(word in name for word in query_words):
+                quality = 'medium'
+            elif normalized_query in self.row_text(doc_id):
+                quality = 'low'
+            else:
+                continue
+
+            tiers[quality].append(doc_id)
+
+        scores = {}
+        if FUZZY_SEARCH:
+            found = {doc_id for ids in tiers.values() for doc_id in ids}
+            scores = self.fuzzy_search(transliterate(normalized_query), found)
+            ranked = sorted(scores, key=lambda doc_id: (scores[doc_id], doc_id))[:FUZZY_MAX_RESULTS]
+            for doc_id in ranked:
+                tiers['translit' if scores[doc_id] == 0 else 'fuzzy'].append(doc_id)
+
+        if trace is not None:
+            trace['scanned'] = len(candidates)
+            trace.update({quality: len(ids) for quality, ids in tiers.items()})
+
+        results = []
+        for quality in sorted(tiers, key=self.QUALITY_ORDER.get):
+            for doc_id in tiers[quality]:
+                student = self.student(doc_id, quality)
+                if doc_id in scores:
+                    student['score'] = scores[doc_id]
+                results.append(student)
+        return results
+
+    def student(self, doc_id: int, quality: str) -> Dict:
+        """Результат поиска для документа индекса"""
+        student = self.store.student(doc_id)
+        return {
+            'group': student.group,
+            'data': student,
+            'index': student.index,
+            'match_quality': quality
+        }
+
+    def prefix_search(self, normalized_query: str, limit: int) -> List[Dict]:
+        """Студенты, имя которых (с любого слова) начинается с запроса"""
+        doc_ids = []
+        seen = set()
+        for prefix in dict.fromkeys((normalized_query, transliterate(normalized_query))):
+            for _, doc_id in self.prefix_entries(prefix):
+                if len(doc_ids) >= limit:
+                    break
+                if doc_id not in seen:
+                    seen.add(doc_id)
+                    doc_ids.append(doc_id)
+        return [self.student(doc_id, 'prefix') for doc_id in doc_ids]
+
+    def prefix_key(self, position: int) -> str:
+        """Ключ записи префиксного индекса: имя документа с начала слова"""
+        name = self.name(self.prefix_docs[position])
+        if self.prefix_folded[position]:
+            name = transliterate(name)
+        return name[self.prefix_starts[position]:]
+
+    def prefix_entries(self, prefix: str):
+        """Пары (ключ, документ) префиксного индекса, начинающиеся с prefix, по порядку"""
+        size = len(self.prefix_docs)
+        position = bisect_left(range(size), prefix, key=self.prefix_key)
+        while position < size:
+            key = self.prefix_key(position)
+            if not key.startswith(prefix):
+                break
+            yield key, self.prefix_docs[position]
+            position += 1
+
+    def match_many(self, matcher: AhoCorasick, folded_queries: List[str]) -> Dict[int, List[int]]:
+        """Документы, транслитерированное имя которых содержит запросы списка
+        
+        Кандидаты всех запросов проверяются одним проходом автомата по
+        имени. Возвращает номер запроса -> документы по порядку.
+        """
+        candidates = set()
+        for query in folded_queries:
+            candidates.update(candidate_docs(query.split(), self.folded_postings, self.ngrams, len(self)))
+
+        matches = {}
+        candidates = sorted(candidates)
+        for doc_id, folded_name in zip(candidates, self.folded_names_of(candidates)):
+            for query_id in matcher.find(folded_name):
+                matches.setdefault(query_id, []).append(doc_id)
+        return matches
+
+    def memory_usage(self) -> int:
+        """Приблизительный объем памяти индекса и хранилища в байтах
+        
+        У индекса из снимка считается объем его данных в отображенном файле.
+        """
+        store = self.store
+        size = sys.getsizeof(self.name_exceptions) + sum(sys.getsizeof(name) for name in self.name_exceptions.values())
+        columns = [store.names, store.phones, store.nicknames, store.other_fields]
+        if isinstance(store.certificates, StringColumn):
+            columns.append(store.certificates)
+        else:
+            size += sys.getsizeof(store.certificates) + sum(sys.getsizeof(text) for text in set(store.certificates))
+        size += sum(column.nbytes for column in columns)
+        for table in (self.postings, self.folded_postings, self.word_docs, self.deletes):
+            if isinstance(table, MappedTable):
+                size += table.nbytes
+            else:
+                size += sys.getsizeof(table) + sum(
+                    sys.getsizeof(key) + sys.getsizeof(values) for key, values in table.items()
+                )
+        arrays = (self.prefix_docs, self.prefix_starts, self.prefix_folded, store.indexes, store.cert_flags)
+        return size + sum(memoryview(values).nbytes for values in arrays)
+
+    def fuzzy_search(self, folded_query: str, exclude: set) -> Dict[int, int]:
+        """Нечеткий поиск по транслитерированным именам
+        
+        Возвращает число опечаток для каждого найденного документа:
+        0 — запрос совпал с именем после транслитерации, иначе каждое
+        слово запроса совпало со словом имени с допустимыми опечатками.
+        """
+        query_words = folded_query.split()
+        if not query_words:
+            return {}
+
+        scores = {}
+        candidates = [doc_id for doc_id in candidate_docs(query_words, self.folded_postings, self.ngrams, len(self))
+                      if doc_id not in exclude]
+        for doc_id, folded_name in zip(candidates, self.folded_names_of(candidates)):
+            if folded_query in folded_name:
+                scores[doc_id] = 0
+
+        if len(query_words) > FUZZY_MAX_WORDS or any(len(word) > FUZZY_MAX_WORD_LENGTH for word in query_words):
+            return scores
+
+        # Для каждого слова запроса: документ -> наименьшее число опечаток
+        per_word = []
+        for query_word in query_words:
+            limit = allowed_typos(query_word)
+            best = {}
+            checked = set()
+            for variant in word_deletes(query_word, limit):
+                for word in self.deletes.get(variant, ()):
+                    if word in checked:
+                        continue
+                    checked.add(word)
+                    distance = edit_distance(query_word, word, limit)
+                    if distance > limit:
+                        continue
+                    for doc_id in self.word_docs[word]:
+                        if distance < best.get(doc_id, limit + 1):
+                            best[doc_id] = distance
+            if not best:
+                return scores
+            per_word.append(best)
+
+        per_word.sort(key=len)
+        for doc_id, distance in per_word[0].items():
+            if doc_id in exclude or doc_id in scores:
+                continue
+            total = distance
+            for best in per_word[1:]:
+                if doc_id not in best:
+                    break
+                total += best[doc_id]
+            else:
+                scores[doc_id] = total
+        return scores
+
+class GroupedSearchIndex:
+    """Поиск по всем загруженным группам, у каждой из которых свой индекс
+    
+    Результаты упорядочены так же, как в едином индексе по всем группам:
+    уровни по очереди, внутри уровня — по порядку групп и строк; нечеткие
+    результаты ранжируются по числу опечаток среди всех групп.
+    """
+
+    def __init__(self, indexes: Dict[str, SearchIndex], version: int = 0):
+        self.indexes = indexes
+        # Версия данных, к которой относятся результаты: по ней кэшируются карточки
+        self.version = version
+
+    def __len__(self) -> int:
+        return sum(len(index) for index in self.indexes.values())
+
+    def student(self, index: SearchIndex, doc_id: int, quality: str) -> Dict:
+        """Результат поиска с версией данных, из которой он взят"""
+        student = index.student(doc_id, quality)
+        student['version'] = self.version
+        return student
+
+    def search(self, normalized_query: str, trace: Optional[Dict] = None) -> List[Dict]:
+        exact = {quality: [] for quality in ('high', 'medium', 'low')}
+        ranked = []
+        for position, index in enumerate(self.indexes.values()):
+            group_trace = {} if trace is not None else None
+            for rank, student in enumerate(index.search(normalized_query, group_trace)):
+                student['version'] = self.version
+                if 'score' in student:
+                    ranked.append((student['score'], position, rank, student))
+                else:
+                    exact[student['match_quality']].append(student)
+            if trace is not None:
+                trace['scanned'] = trace.get('scanned', 0) + group_trace.get('scanned', 0)
+        
+        ranked.sort(key=lambda item: item[:3])
+        fuzzy = [student for *_, student in ranked[:FUZZY_MAX_RESULTS]]
+        if trace is not None:
+            trace.update({quality: len(students) for quality, students in exact.items()})
+            trace['translit'] = sum(1 for student in fuzzy if student['match_quality'] == 'translit')
+            trace['fuzzy'] = len(fuzzy) - trace['translit']
+        return exact['high'] + exact['medium'] + exact['low'] + fuzzy
+
+    def prefix_search(self, normalized_query: str, limit: int) -> List[Dict]:
+        """Студенты всех групп, имя которых начинается с запроса"""
+        indexes = list(self.indexes.values())
+        found = []
+        seen = set()
+        for prefix in dict.fromkeys((normalized_query, transliterate(normalized_query))):
+            entries = heapq.merge(*(
+                self.tagged_entries(index, prefix, position) for position, index in enumerate(indexes)
+            ))
+            for _, position, doc_id in entries:
+                if len(found) >= limit:
+                    break
+                if (position, doc_id) not in seen:
+                    seen.add((position, doc_id))
+                    found.append((position, doc_id))
+        return [self.student(indexes[position], doc_id, 'prefix') for position, doc_id in found]
+
+    def match_many(self, normalized_queries: List[str]) -> List[List[Dict]]:
+        """Студенты всех групп для каждого запроса списка (подстрока имени)
+        
+        Сравнение идет в транслитерированной записи; совпадение без
+        транслитерации помечается как high, иначе как translit.
+        """
+        folded_queries = [transliterate(query) for query in normalized_queries]
+        matcher = AhoCorasick(folded_queries)
+        found = [[] for _ in normalized_queries]
+        for index in self.indexes.values():
+            for query_id, doc_ids in index.match_many(matcher, folded_queries).items():
+                query = normalized_queries[query_id]
+                found[query_id].extend(
+                    self.student(index, doc_id, 'high' if query in index.name(doc_id) else 'translit')
+                    for doc_id in doc_ids
+                )
+        return found
+
+    @staticmethod
+    def tagged_entries(index: SearchIndex, prefix: str, position: int):
+        """Записи префиксного индекса группы с ее номером для слияния"""
+        for key, doc_id in index.prefix_entries(prefix):
+            yield key, position, doc_id
+
+
+class DataState:
+    """Версия данных бота: индексы групп и все производные от них структуры
+    
+    Бот заменяет версию целиком одним присваиванием, а каждый запрос берет
+    ссылку на нее один раз в начале и дальше работает только с ней, поэтому
+    не видит смеси двух версий. Данные версии после создания не меняются;
+    group_pages и stats_texts — кэши готовых ответов по этой версии.
+    """
+
+    __slots__ = ('version', 'group_indexes', 'group_filters', 'group_stats', 'search_index',
+                 'group_pages', 'stats_texts')
+
+    def __init__(self, version: int = 0, group_indexes: Optional[Dict[str, SearchIndex]] = None,
+                 group_filters: Optional[Dict[str, FilterIndex]] = None,
+                 group_stats: Optional[Dict[str, Dict[str, int]]] = None):
+        self.version = version
+        # Поисковый индекс каждой загруженной группы (вместе с хранилищем ее
+        # студентов — единственной копией данных группы) и общий поиск по ним
+        self.group_indexes = group_indexes or {}
+        self.search_index = GroupedSearchIndex(self.group_indexes, version)
+        # Битовые карты признаков каждой загруженной группы для /filter
+        self.group_filters = group_filters or {}
+        # Статистика групп, включая выгруженные из памяти
+        self.group_stats = group_stats or {}
+        # Готовые страницы списков групп: (группа, язык) -> [(текст, клавиатура)]
+        self.group_pages = {}
+        # Тексты статистики по языкам
+        self.stats_texts = {}
+
+
+def write_roster(path: str, state: DataState, header: Optional[Dict] = None):
+    """Запись версии данных в поколоночный файл
+    
+    В этом формате пишутся и снимки для процессов-обработчиков, и локальный
+    снимок для быстрого старта; header дополняет общий заголовок.
+    """
+    writer = RosterWriter()
+    groups = {group: index.to_roster(writer) for group, index in state.group_indexes.items()}
+    # Битовые карты /filter считаются один раз здесь, а не при каждом открытии файла
+    filters = {group: filters.to_roster(writer) for group, filters in state.group_filters.items()}
+    writer.write(path, {
+        'data_version': state.version,
+        'groups': groups,
+        'filters': filters,
+        'group_stats': state.group_stats,
+        **(header or {})
+    })
+
+
+def read_roster(path: str):
+    """Версия данных из поколоночного файла поверх его отображения в память
+    
+    Возвращает заголовок файла и версию данных. Формат другой версии
+    или чужой файл дают ValueError.
+    """
+    roster = RosterFile(path)
+    group_indexes = {
+        group: SearchIndex.from_roster(descriptor, roster)
+        for group, descriptor in roster.header['groups'].items()
+    }
+    group_filters = {
+        group: FilterIndex.from_roster(roster.header['filters'][group], index.store, roster)
+        for group, index in group_indexes.items()
+    }
+    state = DataState(roster.header['data_version'], group_indexes, group_filters, roster.header['group_stats'])
+    return roster.header, state
+
+
+class PreferenceStore:
+    """Языковые настройки пользователей с пакетной отложенной записью
+    
+    Чтение идет из памяти, изменения копятся и записываются фоновым
+    потоком раз в flush_interval секунд, а также при close().
+    """
+
+    def __init__(self, flush_interval: float = PREFERENCES_FLUSH_INTERVAL):
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()
+        self.values = self.read_all()
+        self.pending = {}
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.flush_loop, name='preference-store', daemon=True)
+        self.thread.start()
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def get(self, key: str, default: Optional[str] = None) -> Optional[str]:
+        return self.values.get(key, default)
+
+    def set(self, key: str, value: str):
+        with self.lock:
+            self.values[key] = value
+            self.pending[key] = value
+
+    def flush(self):
+        """Запись накопленных изменений"""
+        with self.write_lock:
+            with self.lock:
+                pending, self.pending = self.pending, {}
+            if not pending:
+                return
+            try:
+                self.write(pending)
+            except Exception as e:
+                logger.error(f"Ошибка сохранения языковых настроек: {e}")
+                # Возвращаем изменения в очередь, не затирая более новые
+                with self.lock:
+                    self.pending = {**pending, **self.pending}
+
+    def flush_loop(self):
+        while not self.stop_event.wait(self.flush_interval):
+            self.flush()
+
+    def close(self):
+        """Остановка фоновой записи с сохранением всех изменений"""
+        self.stop_event.set()
+        if self.thread.is_alive() and self.thread is not threading.current_thread():
+            self.thread.join()
+        self.flush()
+
+    def read_all(self) -> Dict[str, str]:
+        raise NotImplementedError
+
+    def write(self, pending: Dict[str, str]):
+        raise NotImplementedError
+
+
+class JSONPreferenceStore(PreferenceStore):
+    """Настройки в JSON-файле, перезаписываемом атомарно"""
+
+    def __init__(self, path: str, **kwargs):
+        self.path = path
+        super().__init__(**kwargs)
+
+    def read_all(self) -> Dict[str, str]:
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+            except Exception as e:
+                logger.error(f"Ошибка загрузки языковых настроек: {e}")
+        return {}
+
+    def write(self, pending: Dict[str, str]):
+        with self.lock:
+            values = dict(self.values)
+        temp_file = f"{self.path}.{os.getpid()}.tmp"
+        with open(temp_file, 'w', encoding='utf-8') as f:
+            json.dump(values, f, ensure_ascii=False, separators=(',', ':'))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_file, self.path)
+
+
+class SQLitePreferenceStore(PreferenceStore):
+    """Настройки в SQLite (WAL) с записью изменений пачками"""
+
+    def __init__(self, path: str, legacy_json: Optional[str] = None, **kwargs):
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS user_languages ('
+            'user_id TEXT PRIMARY KEY, language TEXT NOT NULL)'
+        )
+        if legacy_json:
+            self.migrate_json(legacy_json)
+        super().__init__(**kwargs)
+
+    def migrate_json(self, path: str):
+        """Однократный перенос настроек из старого JSON-файла"""
+        if not os.path.exists(path):
+            return
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                values = json.load(f)
+        except Exception as e:
+            logger.error(f"Ошибка чтения {path} для переноса настроек: {e}")
+            return
+        with self.connection:
+            self.connection.execute('BEGIN')
+            self.connection.executemany(
+                'INSERT OR IGNORE INTO user_languages (user_id, language) VALUES (?, ?)',
+                values.items()
+            )
+        os.replace(path, f"{path}.migrated")
+        print(f"Языковые настройки перенесены из {path}: {len(values)} пользователей")
+
+    def read_all(self) -> Dict[str, str]:
+        return dict(self.connection.execute('SELECT user_id, language FROM user_languages'))
+
+    def write(self, pending: Dict[str, str]):
+        with self.connection:
+            self.connection.execute('BEGIN')
+            self.connection.executemany(
+                'INSERT INTO user_languages (user_id, language) VALUES (?, ?) '
+                'ON CONFLICT(user_id) DO UPDATE SET language = excluded.language',
+                pending.items()
+            )
+
+    def close(self):
+        super().close()
+        self.connection.close()
+
+
+class WorkerPreferenceStore(PreferenceStore):
+    """Языки пользователей в процессе-обработчике: приходят вместе с задачами"""
+
+    def read_all(self) -> Dict[str, str]:
+        return {}
+
+    def write(self, pending: Dict[str, str]):
+        pass
+
+
+def create_preference_store() -> PreferenceStore:
+    """Хранилище языковых настроек согласно USER_LANGUAGE_STORE"""
+    if USER_LANGUAGE_STORE == 'sqlite':
+        try:
+            return SQLitePreferenceStore(USER_LANGUAGE_DB, legacy_json=USER_LANGUAGE_FILE)
+        except sqlite3.Error as e:
+            logger.error(f"SQLite недоступен ({e}), языковые настройки хранятся в {USER_LANGUAGE_FILE}")
+    return JSONPreferenceStore(USER_LANGUAGE_FILE)
+
+
+class Overloaded(Exception):
+    """Очередь операций с данными переполнена"""
+
+
+class DataExecutor:
+    """Выполнение операций с данными в ограниченном пуле потоков
+    
+    Одновременно принимается не больше workers + queue_limit задач:
+    лишние сразу отклоняются с Overloaded, а не копятся в очереди.
+    Задача, не уложившаяся в timeout, завершается asyncio.TimeoutError.
+    """
+
+    def __init__(self, workers: int, queue_limit: int, timeout: float):
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='data')
+        self.capacity = workers + queue_limit
+        self.active = 0
+        self.timeout = timeout
+
+    async def run(self, func, *args, user_id: Optional[int] = None):
+        """Выполнить func(*args); user_id — пользователь, для которого готовится ответ"""
+        if self.active >= self.capacity:
+            raise Overloaded()
+        
+        loop = asyncio.get_running_loop()
+        future = self.submit(func, args, user_id)
+        self.active += 1
+        # Место освобождается, когда поток действительно закончил работу
+        future.add_done_callback(lambda _: loop.call_soon_threadsafe(self.release))
+        return await asyncio.wait_for(asyncio.wrap_future(future), self.timeout)
+
+    def submit(self, func, args: tuple, user_id: Optional[int]):
+        return self.pool.submit(func, *args)
+
+    def release(self):
+        self.active -= 1
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+
+class WorkerProcessExecutor(DataExecutor):
+    """Выполнение операций с данными бота в процессах-обработчиках
+    
+    Координатор получает обновления, а методы бота выполняются в
+    processes процессах по поколоночному снимку, который бот публикует
+    при каждой смене версии данных. Пока снимка нет, операции выполняются
+    в потоках координатора.
+    """
+
+    def __init__(self, bot: 'StudentBot', processes: int, queue_limit: int, timeout: float):
+        super().__init__(WORKER_THREADS, queue_limit, timeout)
+        self.bot = bot
+        self.processes = processes
+        self.capacity = processes + queue_limit
+        self.process_pool = self.create_process_pool()
+
+    def create_process_pool(self) -> ProcessPoolExecutor:
+        # spawn: форк процесса с потоками (запись настроек, пул потоков) небезопасен
+        return ProcessPoolExecutor(max_workers=self.processes, mp_context=multiprocessing.get_context('spawn'))
+
+    def submit(self, func, args: tuple, user_id: Optional[int]):
+        roster_path = self.bot.roster_path
+        if roster_path is None or getattr(func, '__self__', None) is not self.bot:
+            return super().submit(func, args, user_id)
+        
+        languages = {str(user_id): self.bot.get_user_language(user_id)} if user_id is not None else {}
+        try:
+            return self.process_pool.submit(run_worker_task, roster_path, func.__name__, languages, *args)
+        except BrokenProcessPool:
+            # Процесс-обработчик аварийно завершился: пул нужно создать заново
+            logger.error("Пул процессов-обработчиков поврежден, создаем заново")
+            self.process_pool.shutdown(wait=False, cancel_futures=True)
+            self.process_pool = self.create_process_pool()
+            return self.process_pool.submit(run_worker_task, roster_path, func.__name__, languages, *args)
+
+    def warm_up(self):
+        """Запуск процессов заранее, чтобы первые запросы не ждали импорта"""
+        for _ in range(self.processes):
+            self.process_pool.submit(os.getpid)
+
+    def shutdown(self):
+        super().shutdown()
+        self.process_pool.shutdown(wait=False, cancel_futures=True)
+
+
+class CallbackCollector(Collector):
+    """Метрика, значения которой вычисляются при каждом запросе /metrics
+    
+    func возвращает словарь {значения меток: значение метрики}.
+    """
+
+    FAMILIES = {'gauge': GaugeMetricFamily, 'counter': CounterMetricFamily}
+
+    def __init__(self, name: str, documentation: str, metric_type: str, func, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.metric_type = metric_type
+        self.func = func
+        self.labelnames = labelnames
+
+    def collect(self):
+        try:
+            values = self.func()
+        except Exception as e:
+            logger.error(f"Ошибка расчета метрики {self.name}: {e}")
+            return
+        family = self.FAMILIES[self.metric_type](self.name, self.documentation, labels=self.labelnames)
+        for labels, value in values.items():
+            family.add_metric([str(label) for label in labels], value)
+        yield family
+
+
+# Корзины гистограмм длительностей, сек: до таймаута загрузки CSV
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+metrics = CollectorRegistry()
+updates_total = Counter('bot_updates_total', 'Обработанные обновления Telegram', ('handler',), registry=metrics)
+handler_errors_total = Counter('bot_handler_errors_total', 'Исключения в обработчиках', ('handler',),
+                               registry=metrics)
+handler_seconds = Histogram('bot_handler_seconds', 'Длительность обработки обновления', ('handler',),
+                            registry=metrics, buckets=DURATION_BUCKETS)
+rate_limited_total = Counter('bot_rate_limited_total', 'Обновления, отклоненные лимитом частоты', ('handler',),
+                             registry=metrics)
+overloaded_total = Counter('bot_overloaded_total', 'Операции, отклоненные перегруженным пулом', ('operation',),
+                           registry=metrics)
+search_results = Histogram('bot_search_results', 'Число результатов поиска', registry=metrics,
+                           buckets=(0, 1, 2, 5, 10, 20, 50, 100, 500, 1000))
+data_load_seconds = Histogram('bot_data_load_seconds', 'Длительность загрузки данных всех групп', ('mode',),
+                              registry=metrics, buckets=DURATION_BUCKETS)
+group_fetch_seconds = Histogram('bot_group_fetch_seconds', 'Длительность скачивания CSV группы', ('group',),
+                                registry=metrics, buckets=DURATION_BUCKETS)
+group_parse_seconds = Histogram('bot_group_parse_seconds', 'Длительность разбора CSV группы', ('group',),
+                                registry=metrics, buckets=DURATION_BUCKETS)
+group_load_failures_total = Counter('bot_group_load_failures_total', 'Неудачные загрузки групп', ('group',),
+                                    registry=metrics)
+api_requests_total = Counter('bot_api_requests_total', 'Запросы к Bot API', ('endpoint',), registry=metrics)
+api_errors_total = Counter('bot_api_errors_total', 'Ошибки запросов к Bot API', ('endpoint', 'error'),
+                           registry=metrics)
+
+
+class TokenBucket:
+    """Корзина токенов: пополняется на rate токенов в секунду, вмещает не больше capacity"""
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def try_acquire(self) -> bool:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+class UserRateLimiter:
+    """Ограничение частоты входящих запросов: корзина токенов на пользователя"""
+
+    def __init__(self, rate: float, burst: float, max_users: int = 100000):
+        self.rate = rate
+        self.burst = burst
+        self.max_users = max_users
+        self.buckets = OrderedDict()
+        self.warned = set()
+
+    def allow(self, user_id: int) -> bool:
+        bucket = self.buckets.get(user_id)
+        if bucket is None:
+            bucket = TokenBucket(self.rate, self.burst)
+            self.buckets[user_id] = bucket
+            # Забываем самых давно активных пользователей
+            if len(self.buckets) > self.max_users:
+                old_user, _ = self.buckets.popitem(last=False)
+                self.warned.discard(old_user)
+        else:
+            self.buckets.move_to_end(user_id)
+        
+        if bucket.try_acquire():
+            self.warned.discard(user_id)
+            return True
+        return False
+
+    def should_warn(self, user_id: int) -> bool:
+        """Предупреждать пользователя только один раз за серию отклоненных запросов"""
+        if user_id in self.warned:
+            return False
+        self.warned.add(user_id)
+        return True
+
+
+class TelegramRateLimiter(AIORateLimiter):
+    """Исходящие запросы к Bot API в пределах лимитов Telegram с учетом в метриках
     
-    def load_user_languages(self) -> Dict[str, str]:
-        """Загрузка языковых настроек пользователей из файла"""
-        if os.path.exists(USER_LANGUAGE_FILE):
+    Лимиты и повтор после RetryAfter обеспечивает AIORateLimiter; каждая
+    попытка, включая повторы, учитывается в bot_api_requests_total.
+    """
+
+    def __init__(self):
+        super().__init__(overall_max_rate=OUTGOING_GLOBAL_RATE, group_max_rate=OUTGOING_GROUP_CHAT_RATE,
+                         max_retries=OUTGOING_MAX_RETRIES)
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        async def counted_callback(*callback_args, **callback_kwargs):
+            api_requests_total.labels(endpoint).inc()
             try:
-                with open(USER_LANGUAGE_FILE, 'r', encoding='utf-8') as f:
-                    return json.load(f)
+                return await callback(*callback_args, **callback_kwargs)
             except Exception as e:
-                logger.error(f"Ошибка загрузки языковых настроек: {e}")
-        return {}
-    
-    def save_user_languages(self):
-        """Сохранение языковых настроек пользователей в файл"""
-        try:
-            with open(USER_LANGUAGE_FILE, 'w', encoding='utf-8') as f:
-                json.dump(self.user_languages, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            logger.error(f"Ошибка сохранения языковых настроек: {e}")
+                api_errors_total.labels(endpoint, type(e).__name__).inc()
+                raise
+        return await super().process_request(counted_callback, args, kwargs, endpoint, data, rate_limit_args)
+
+
+class StudentBot:
+    def __init__(self, urls: Optional[Dict[str, str]] = None, autoload: bool = True,
+                 preferences: Optional[PreferenceStore] = None,
+                 registry: Optional[Dict[str, Dict]] = None,
+                 roster_dir: Optional[str] = None):
+        # Реестр групп: имя -> {'url': адрес CSV, 'columns': колонки ролей}
+        if registry is None:
+            registry = ({group: {'url': url, 'columns': {}} for group, url in urls.items()}
+                        if urls is not None else GROUP_REGISTRY)
+        self.registry = registry
+        self.urls = {group: config['url'] for group, config in registry.items()}
+        # Разделитель, колонки и типы CSV каждой группы после первого разбора
+        self.csv_schemas = {}
+        # ETag/Last-Modified и хэш содержимого последней загрузки каждой группы
+        self.http_validators = {}
+        self.content_digests = {}
+        # Текущая версия данных; заменяется целиком при каждом обновлении
+        self.state = DataState()
+        # Ленивая загрузка: группы, загружаемые сейчас (одна загрузка на группу),
+        # время последнего обращения и оценка памяти каждой группы
+        self.loading = {}
+        self.loading_lock = threading.Lock()
+        self.update_lock = threading.RLock()
+        self.group_access = {}
+        self.group_sizes = {}
+        # Время последней неудачной загрузки группы: повтор не чаще GROUP_RETRY_INTERVAL
+        self.load_failures = {}
+        # Группы, выгруженные из памяти; их статистика остается актуальной
+        self.evicted = set()
+        self.group_keyboard_markup = None
+        # Режим процессов-обработчиков: каталог, куда публикуется поколоночный
+        # снимок каждой версии данных, и путь к снимку текущей версии
+        self.roster_dir = roster_dir
+        self.roster_path = None
+        self.published_rosters = []
+        # Результаты поиска: (версия данных, нормализованный запрос) -> список
+        self.search_cache = TTLCache(SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL)
+        # Готовые карточки студентов: (версия данных, группа, индекс строки, язык) -> текст
+        self.student_cards = TTLCache(CARD_CACHE_SIZE)
+        # Клавиатуры главного меню по языкам от данных не зависят
+        self.main_menus = {}
+        self.inline_cache = TTLCache(INLINE_CACHE_SIZE, INLINE_CACHE_TTL)
+        self.user_languages = preferences if preferences is not None else create_preference_store()
+        # Данные из снимка отвечают сразу, а сеть перепроверяется в фоне
+        self.loaded_from_snapshot = False
+        # Начальная загрузка завершена; до этого обработчики ждут ее
+        # не дольше READY_TIMEOUT. Длительность фаз запуска, сек
+        self.ready = asyncio.Event()
+        self.startup_timings = {'import': IMPORT_SECONDS}
+        if autoload:
+            self.loaded_from_snapshot = self.load_snapshot()
+            # В ленивом режиме группы загружаются при первом обращении
+            if not self.loaded_from_snapshot and not GROUPS_LAZY:
+                self.load_data()
+            self.ready.set()
     
     def normalize_text(self, text: str) -> str:
         """Нормализация текста для поиска"""
@@ -197,105 +2133,547 @@ class StudentBot:
     
         return text
     
-    def has_certificate(self, row: pd.Series) -> bool:
-        """Проверка наличия сертификата у студента"""
-        # Ищем колонки, которые могут содержать информацию о сертификатах
-        cert_columns = []
-        
-        for col in row.index:
-            col_lower = str(col).lower()
-            if any(keyword in col_lower for keyword in ['sertifikat', 'certificate', 'cert']):
-                cert_columns.append(col)
-        
-        # Если нашли колонки с сертификатами, проверяем их
-        for col in cert_columns:
-            value = row[col]
-            if pd.notna(value):
-                value_str = str(value).strip()
-                # Проверяем, что значение не пустое и не является стандартными "пустыми" значениями
-                if value_str and value_str.lower() not in ['', 'nan', 'none', 'null', '-', 'n/a']:
-                    return True
+    def resolve_cert_columns(self, columns) -> List:
+        """Колонки, которые могут содержать информацию о сертификатах"""
+        return [
+            col for col in columns
+            if col not in DERIVED_COLUMNS
+            and any(keyword in str(col).lower() for keyword in CERT_KEYWORDS)
+        ]
+    
+    def add_certificate_columns(self, df: pd.DataFrame, cert_columns: Optional[List] = None) -> pd.DataFrame:
+        """Векторный расчет флага и текста сертификатов для всей группы
         
-        return False
+        Без явного списка cert_columns колонки определяются по названию.
+        """
+        has_cert = pd.Series(False, index=df.index)
+        cert_text = pd.Series('', index=df.index, dtype=object)
+        
+        if cert_columns is None:
+            cert_columns = self.resolve_cert_columns(df.columns)
+        for col in (col for col in cert_columns if col in df.columns):
+            values = df[col].astype(str).str.strip()
+            # Значение не пустое и не является стандартным "пустым" значением
+            valid = df[col].notna() & ~values.str.lower().isin(CERT_EMPTY_VALUES)
+            values = values.where(valid, '')
+            
+            separator = np.where((cert_text != '') & valid, ', ', '')
+            cert_text = cert_text + separator + values
+            has_cert |= valid
+        
+        df[CERT_FLAG_COLUMN] = has_cert
+        df[CERT_TEXT_COLUMN] = cert_text
+        return df
+    
+    def group_columns(self, group: str) -> Dict[str, List]:
+        """Колонки ролей группы, заданные в реестре"""
+        return self.registry.get(group, {}).get('columns', {})
     
     def load_data(self):
         """Загрузка данных студентов из CSV файлов"""
-        urls = {
-            'D1': 'https://hebbkx1anhila5yf.public.blob.vercel-storage.com/group_d1-PV7nQS7IQwFS9e2ps8nTKOBoGIv2br.csv',
-            'D2': 'https://hebbkx1anhila5yf.public.blob.vercel-storage.com/group_d2-WQjbXhJy4zuB1uPnTEYsP27kTALVq0.csv',
-            'D3': 'https://hebbkx1anhila5yf.public.blob.vercel-storage.com/group_d3-uPiNK14aokZuaaFV8DjGlyE94Qkkl9.csv',
-            'D4': 'https://hebbkx1anhila5yf.public.blob.vercel-storage.com/group_d4-ln5jYKnT5nlI7UQxO2xBBdXrvtMHV9.csv'
-        }
+        asyncio.run(self.load_data_async())
+    
+    async def startup(self):
+        """Начальная загрузка данных в фоне после запуска приложения
+        
+        Сначала читается снимок, без него (и не в ленивом режиме) данные
+        скачиваются. Готовность выставляется и при неудачной загрузке:
+        тогда данные появятся при следующем фоновом обновлении.
+        """
+        started = time.perf_counter()
+        try:
+            with self.startup_phase('snapshot'):
+                self.loaded_from_snapshot = await asyncio.to_thread(self.load_snapshot)
+            if not self.loaded_from_snapshot and not GROUPS_LAZY:
+                await self.load_data_async()
+        except Exception as e:
+            logger.error(f"Ошибка начальной загрузки данных: {e}")
+        finally:
+            self.ready.set()
+        
+        phases = ' '.join(f"{phase}={seconds:.2f}s" for phase, seconds in self.startup_timings.items())
+        logger.info(f"Данные готовы за {time.perf_counter() - started:.2f}s "
+                    f"(с начала импорта {time.perf_counter() - IMPORT_STARTED:.2f}s): {phases}")
+    
+    @contextlib.contextmanager
+    def startup_phase(self, phase: str):
+        """Учет длительности фазы запуска; после готовности данных не ведется"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            if not self.ready.is_set():
+                self.startup_timings[phase] = self.startup_timings.get(phase, 0.0) + time.perf_counter() - started
+    
+    async def load_data_async(self, conditional: bool = False,
+                              groups: Optional[List[str]] = None) -> List[str]:
+        """Параллельная загрузка CSV групп (по умолчанию всех) через общий пул соединений
+        
+        При conditional=True запросы отправляются с ETag/Last-Modified
+        предыдущей загрузки, и разбираются только изменившиеся группы.
+        Возвращает список обновленных групп.
+        """
+        if groups is None:
+            groups = list(self.urls)
+        mode = 'refresh' if conditional else ('initial' if len(groups) == len(self.urls) else 'lazy')
+        with data_load_seconds.labels(mode).time():
+            return await self.fetch_and_update(conditional, groups)
+    
+    async def fetch_and_update(self, conditional: bool, groups: List[str]) -> List[str]:
+        """Скачивание групп и разбор изменившихся"""
+        limits = httpx.Limits(max_connections=max(len(groups), 1))
+        with self.startup_phase('fetch'):
+            async with httpx.AsyncClient(limits=limits, follow_redirects=True) as client:
+                contents = await asyncio.gather(*(
+                    self.fetch_group(client, group, self.urls[group], conditional)
+                    for group in groups
+                ))
+        
+        changed = {}
+        for group, content in zip(groups, contents):
+            if content is None:
+                continue
+            # Сервер может не поддерживать условные запросы: сверяем содержимое
+            digest = hashlib.sha1(content).hexdigest()
+            if conditional and self.content_digests.get(group) == digest:
+                continue
+            changed[group] = (content, digest)
+        
+        if not changed:
+            return []
         
-        for group, url in urls.items():
+        # Разбор и построение индекса выполняются вне цикла событий
+        return await asyncio.to_thread(self.update_groups, changed)
+    
+    def update_groups(self, changed: Dict[str, tuple]) -> List[str]:
+        """Разбор изменившихся групп и замена данных новой версией"""
+        with self.update_lock:
+            return self.update_groups_locked(changed)
+    
+    def update_groups_locked(self, changed: Dict[str, tuple]) -> List[str]:
+        group_indexes = dict(self.state.group_indexes)
+        updated = []
+        for group, (content, digest) in changed.items():
             try:
-                print(f"Загрузка данных группы {group} из {url}")
-                response = requests.get(url, timeout=30)
-                content = response.content.decode('utf-8', errors='ignore')
-                
-                # Создаем временный файл
-                temp_file = f'temp_{group.lower()}.csv'
-                with open(temp_file, 'w', encoding='utf-8') as f:
-                    f.write(content)
-                
-                print(f"Файл {temp_file} создан, размер: {len(content)} байт")
-                
-                # Пробуем разные способы чтения CSV
-                df = None
-                
-                # Сначала пробуем с разделителем ;
-                try:
-                    df = pd.read_csv(temp_file, delimiter=';')
-                    print(f"Группа {group} загружена с разделителем ';'")
-                except Exception as e:
-                    print(f"Ошибка при загрузке с разделителем ';': {e}")
-                
-                # Если не получилось, пробуем с запятой
-                if df is None or df.empty:
-                    try:
-                        df = pd.read_csv(temp_file, delimiter=',')
-                        print(f"Группа {group} загружена с разделителем ','")
-                    except Exception as e:
-                        print(f"Ошибка при загрузке с разделителем ',': {e}")
-                
-                # Если все еще не получилось, пробуем автоопределение
-                if df is None or df.empty:
-                    try:
-                        df = pd.read_csv(temp_file)
-                        print(f"Группа {group} загружена с автоопределением разделителя")
-                    except Exception as e:
-                        print(f"Не удалось загрузить группу {group}: {e}")
-                        continue
-                
-                if df is not None and not df.empty:
-                    # Очищаем данные
-                    df = df.dropna(how='all')  # Удаляем полностью пустые строки
-                    
-                    # Логируем информацию о колонках
-                    print(f"Группа {group}: колонки = {list(df.columns)}")
-                    
-                    # Добавляем нормализованные имена для поиска
-                    df['normalized_name'] = df.apply(
-                        lambda row: self.normalize_text(self.get_student_name(row)), 
-                        axis=1
-                    )
-                    
-                    # Проверяем наличие сертификатов для отладки
-                    cert_count = 0
-                    for _, row in df.iterrows():
-                        if self.has_certificate(row):
-                            cert_count += 1
-                    
-                    print(f"Группа {group}: {len(df)} студентов, {cert_count} с сертификатами")
-                    
-                    self.students_data[group] = df
-                
-                # Удаляем временный файл
-                if os.path.exists(temp_file):
-                    os.remove(temp_file)
-                    
+                with group_parse_seconds.labels(group).time(), self.startup_phase('parse'):
+                    df = self.process_group_data(group, content)
+                if df is not None:
+                    # DataFrame нужен только для построения индекса и дальше не хранится
+                    group_indexes[group] = self.build_group_index(group, df)
+                    self.content_digests[group] = digest
+                    self.load_failures.pop(group, None)
+                    updated.append(group)
+                else:
+                    group_load_failures_total.labels(group).inc()
+                    self.load_failures[group] = time.monotonic()
             except Exception as e:
+                group_load_failures_total.labels(group).inc()
+                self.load_failures[group] = time.monotonic()
                 print(f"Ошибка загрузки группы {group}: {e}")
+        
+        if updated or not self.state.version:
+            self.apply_group_indexes(group_indexes)
+        if updated:
+            self.save_snapshot()
+        return updated
+    
+    def ensure_groups(self, groups: List[str], protected: Optional[set] = None):
+        """Загрузить еще не загруженные группы реестра
+        
+        Каждую группу загружает только один поток: остальные, кому она
+        нужна одновременно, ждут окончания этой загрузки. После загрузки
+        при превышении бюджета памяти выгружаются группы не из protected
+        (по умолчанию — все, кроме запрошенных).
+        
+        Загрузка в запросе пользователя идет только в ленивом режиме:
+        иначе бот отвечает по загруженным группам, а не загрузившиеся
+        повторяет фоновое обновление.
+        """
+        now = time.monotonic()
+        for group in groups:
+            self.group_access[group] = now
+        if not GROUPS_LAZY:
+            return
+        missing = [
+            group for group in groups
+            if group in self.urls and group not in self.state.group_indexes
+            and now - self.load_failures.get(group, -GROUP_RETRY_INTERVAL) >= GROUP_RETRY_INTERVAL
+        ]
+        if not missing:
+            return
+        
+        owned, pending = [], []
+        with self.loading_lock:
+            for group in missing:
+                future = self.loading.get(group)
+                if future is None:
+                    future = self.loading[group] = Future()
+                    owned.append(group)
+                pending.append(future)
+        
+        if owned:
+            try:
+                # Выгруженную группу скачиваем заново целиком, без условных заголовков
+                for group in owned:
+                    self.http_validators.pop(group, None)
+                    self.content_digests.pop(group, None)
+                asyncio.run(self.load_data_async(groups=owned))
+                if any(group in self.state.group_indexes for group in owned):
+                    with self.update_lock:
+                        self.evict_groups(set(groups) if protected is None else protected)
+            finally:
+                with self.loading_lock:
+                    for group in owned:
+                        self.loading.pop(group).set_result(None)
+        for future in pending:
+            future.result()
+    
+    def ensure_searchable_groups(self):
+        """Загрузить группы для поиска и статистики по всем группам
+        
+        С бюджетом памяти выгруженные группы в поиск не возвращаются,
+        а загруженные поиском не защищены от выгрузки: иначе каждый поиск
+        загружал бы все группы и бюджет не соблюдался бы.
+        """
+        if GROUPS_MEMORY_BUDGET_MB > 0:
+            self.ensure_groups([group for group in self.urls if group not in self.evicted], protected=set())
+        else:
+            self.ensure_groups(list(self.urls))
+    
+    def evict_groups(self, protected: set):
+        """Выгрузка давно не использованных групп при превышении бюджета памяти"""
+        if GROUPS_MEMORY_BUDGET_MB <= 0:
+            return
+        budget = GROUPS_MEMORY_BUDGET_MB * 2 ** 20
+        resident = [group for group in self.state.group_indexes if group in self.group_sizes]
+        total = sum(self.group_sizes[group] for group in resident)
+        if total <= budget:
+            return
+        
+        group_indexes = dict(self.state.group_indexes)
+        evicted = []
+        for group in sorted(resident, key=lambda group: self.group_access.get(group, 0)):
+            if total <= budget:
+                break
+            if group in protected:
+                continue
+            del group_indexes[group]
+            total -= self.group_sizes.pop(group)
+            evicted.append(group)
+        if not evicted:
+            return
+        
+        self.evicted.update(evicted)
+        self.apply_group_indexes(group_indexes)
+        logger.info(f"Выгружены группы {', '.join(evicted)}: данные групп занимают ~{total / 2 ** 20:.0f} МБ")
+    
+    async def refresh_data(self):
+        """Фоновая перепроверка данных условными запросами
+        
+        В ленивом режиме проверяются только группы в памяти: остальные
+        загрузятся при обращении; иначе заодно повторяется загрузка
+        не загрузившихся групп.
+        """
+        try:
+            if GROUPS_LAZY:
+                groups = list(self.state.group_indexes)
+            else:
+                groups = [group for group in self.urls if group not in self.evicted]
+            updated = await self.load_data_async(conditional=True, groups=groups)
+            if updated:
+                logger.info(f"Данные обновлены: {', '.join(updated)} (версия {self.state.version})")
+        except Exception as e:
+            logger.error(f"Ошибка фонового обновления данных: {e}")
+    
+    def save_snapshot(self):
+        """Сохранение загруженных данных в локальный снимок
+        
+        Снимок — поколоночный файл того же формата, что и у обработчиков;
+        в заголовок добавляется все, что нужно для проверки его пригодности
+        и условных запросов после старта.
+        """
+        if not SNAPSHOT_FILE:
+            return
+        try:
+            write_roster(SNAPSHOT_FILE, self.state, {
+                'urls': dict(self.urls),
+                'columns': self.snapshot_columns(),
+                'csv_schemas': self.csv_schemas,
+                'http_validators': self.http_validators,
+                'content_digests': self.content_digests
+            })
+            print(f"Снимок данных сохранен в {SNAPSHOT_FILE}")
+        except Exception as e:
+            logger.error(f"Ошибка сохранения снимка данных: {e}")
+    
+    def snapshot_columns(self) -> Dict[str, Dict[str, List]]:
+        """Колонки ролей всех групп — часть ключа снимка вместе с URL"""
+        # Как после чтения из JSON-заголовка снимка: кортежи становятся списками
+        return json.loads(json.dumps({group: self.group_columns(group) for group in self.urls}))
+    
+    def load_snapshot(self) -> bool:
+        """Загрузка данных из локального снимка, если он подходит
+        
+        Индексы работают прямо по отображенному в память файлу; группы,
+        которые потом изменятся, заменятся построенными заново.
+        """
+        if not SNAPSHOT_FILE or not os.path.exists(SNAPSHOT_FILE):
+            return False
+        try:
+            header, state = read_roster(SNAPSHOT_FILE)
+        except ValueError as e:
+            print(f"{e}, пропускаем")
+            return False
+        except Exception as e:
+            logger.error(f"Ошибка чтения снимка данных: {e}")
+            return False
+        
+        # Снимок сделан для другого набора источников
+        if header.get('urls') != dict(self.urls):
+            print("Снимок данных относится к другим источникам, пропускаем")
+            return False
+        # Колонки ролей определяют сертификаты и поиск, поэтому их смена тоже делает снимок непригодным
+        if header['columns'] != self.snapshot_columns():
+            print("Снимок данных сделан для других колонок групп, пропускаем")
+            return False
+        
+        self.csv_schemas = header['csv_schemas']
+        self.http_validators = header['http_validators']
+        self.content_digests = header['content_digests']
+        self.apply_group_indexes(state.group_indexes, state)
+        print(f"Данные загружены из снимка {SNAPSHOT_FILE}: {', '.join(state.group_indexes)}")
+        return True
+    
+    def build_group_index(self, group: str, df: pd.DataFrame) -> SearchIndex:
+        """Поисковый индекс группы вместе с поколоночным хранилищем ее студентов"""
+        with self.startup_phase('index'):
+            index = SearchIndex({group: df}, self.group_columns(group))
+        print(f"Поисковый индекс группы {group} построен: {len(index)} студентов, "
+              f"{len(index.postings)} n-грамм")
+        return index
+    
+    def apply_group_indexes(self, group_indexes: Dict[str, SearchIndex], prepared: Optional[DataState] = None):
+        """Установка новой версии данных вместе с производными структурами
+        
+        Битовые карты, оценка памяти и статистика пересчитываются только
+        для групп, индекс которых изменился. prepared — версия из снимка:
+        ее битовые карты и статистика берутся без пересчета.
+        """
+        # Группы храним в порядке реестра, чтобы порядок результатов не зависел от порядка загрузки
+        order = {group: position for position, group in enumerate(self.registry)}
+        group_indexes = {
+            group: group_indexes[group]
+            for group in sorted(group_indexes, key=lambda group: order.get(group, len(order)))
+        }
+        
+        previous = self.state
+        source = prepared if prepared is not None else previous
+        group_filters = {}
+        group_stats = {}
+        for group, index in group_indexes.items():
+            unchanged = source.group_indexes.get(group) is index
+            if unchanged and group in source.group_filters:
+                group_filters[group] = source.group_filters[group]
+            else:
+                group_filters[group] = FilterIndex(index.store)
+            if group not in self.group_sizes or not unchanged:
+                self.group_sizes[group] = index.memory_usage()
+            
+            if unchanged and group in source.group_stats:
+                group_stats[group] = source.group_stats[group]
+            else:
+                group_stats[group] = self.compute_group_stats(index.store)
+            self.evicted.discard(group)
+        
+        # Статистика выгруженных групп не меняется, пока они не загружены снова
+        for group in self.evicted:
+            if group in previous.group_stats:
+                group_stats[group] = previous.group_stats[group]
+        group_stats = dict(sorted(group_stats.items(), key=lambda item: order.get(item[0], len(order))))
+        
+        # Запросы, начатые до замены, дорабатывают по прежней версии
+        self.state = DataState(previous.version + 1, group_indexes, group_filters, group_stats)
+        # Записи прошлой версии больше не запрашиваются, счетчики сохраняем
+        self.student_cards.clear()
+        self.search_cache.clear()
+        release_memory()
+        if self.roster_dir is not None:
+            self.publish_roster()
+    
+    def publish_roster(self):
+        """Публикация текущей версии данных для процессов-обработчиков
+        
+        Хранятся снимки текущей и предыдущей версий: задачу, отправленную
+        до смены версии, обработчик еще может выполнить по старому снимку.
+        Если запись не удалась, операции выполняются в потоках координатора.
+        """
+        state = self.state
+        path = os.path.join(self.roster_dir, f"studentbot-roster-{os.getpid()}-{state.version}.bin")
+        started = time.perf_counter()
+        try:
+            write_roster(path, state)
+        except Exception as e:
+            logger.error(f"Ошибка публикации данных для обработчиков: {e}")
+            self.roster_path = None
+            return
+        
+        self.roster_path = path
+        self.published_rosters.append(path)
+        while len(self.published_rosters) > 2:
+            with contextlib.suppress(OSError):
+                os.remove(self.published_rosters.pop(0))
+        print(f"Данные версии {state.version} опубликованы для обработчиков: {path} "
+              f"({os.path.getsize(path) / 2 ** 20:.1f} МБ, {time.perf_counter() - started:.2f}s)")
+    
+    def remove_rosters(self):
+        """Удаление опубликованных снимков при остановке"""
+        self.roster_path = None
+        while self.published_rosters:
+            with contextlib.suppress(OSError):
+                os.remove(self.published_rosters.pop())
+    
+    @classmethod
+    def from_roster(cls, path: str) -> 'StudentBot':
+        """Бот процесса-обработчика поверх опубликованного снимка
+        
+        Источников у него нет, поэтому он ничего не загружает сам;
+        язык пользователя приходит вместе с каждой задачей.
+        """
+        worker = cls(urls={}, autoload=False, preferences=WorkerPreferenceStore())
+        _, worker.state = read_roster(path)
+        worker.roster_path = path
+        worker.ready.set()
+        return worker
+    
+    async def fetch_group(self, client: httpx.AsyncClient, group: str, url: str,
+                          conditional: bool = False) -> Optional[bytes]:
+        """Скачать CSV группы с таймаутом и повторными попытками
+        
+        Возвращает None, если загрузка не удалась или данные не изменились.
+        """
+        headers = {}
+        validators = self.http_validators.get(group, {}) if conditional else {}
+        if validators.get('etag'):
+            headers['If-None-Match'] = validators['etag']
+        if validators.get('last_modified'):
+            headers['If-Modified-Since'] = validators['last_modified']
+        
+        with group_fetch_seconds.labels(group).time():
+            content = await self.fetch_group_attempts(client, group, url, headers)
+        if content is False:
+            group_load_failures_total.labels(group).inc()
+            self.load_failures[group] = time.monotonic()
+            return None
+        return content
+    
+    async def fetch_group_attempts(self, client: httpx.AsyncClient, group: str, url: str,
+                                   headers: Dict[str, str]):
+        """Попытки скачать CSV группы; False, если загрузка не удалась"""
+        for attempt in range(1, LOAD_RETRIES + 1):
+            try:
+                print(f"Загрузка данных группы {group} из {url} (попытка {attempt}/{LOAD_RETRIES})")
+                response = await asyncio.wait_for(
+                    client.get(url, headers=headers, timeout=LOAD_TIMEOUT), LOAD_TIMEOUT
+                )
+                if response.status_code == 304:
+                    print(f"Группа {group} не изменилась")
+                    return None
+                response.raise_for_status()
+                self.http_validators[group] = {
+                    'etag': response.headers.get('ETag'),
+                    'last_modified': response.headers.get('Last-Modified')
+                }
+                return response.content
+            except httpx.HTTPStatusError as e:
+                print(f"Ошибка загрузки группы {group}: HTTP {e.response.status_code}")
+                # Ошибки клиента (404 и т.п.) повторять бесполезно
+                if e.response.status_code < 500:
+                    return False
+            except (httpx.HTTPError, asyncio.TimeoutError) as e:
+                print(f"Ошибка загрузки группы {group}: {e!r}")
+            
+            if attempt < LOAD_RETRIES:
+                await asyncio.sleep(LOAD_RETRY_DELAY * attempt)
+        
+        print(f"Не удалось загрузить группу {group} после {LOAD_RETRIES} попыток")
+        return False
+    
+    def detect_csv_delimiter(self, raw: bytes) -> str:
+        """Определение разделителя CSV по начальному фрагменту файла"""
+        sample = raw[:CSV_SNIFF_BYTES].decode('utf-8', errors='ignore')
+        try:
+            return csv.Sniffer().sniff(sample, delimiters=CSV_DELIMITERS).delimiter
+        except csv.Error:
+            # Sniffer не справился: берем самый частый разделитель в заголовке
+            header = sample.split('\n', 1)[0]
+            counts = {delimiter: header.count(delimiter) for delimiter in CSV_DELIMITERS}
+            best = max(counts, key=counts.get)
+            return best if counts[best] else ';'
+    
+    def read_csv_bytes(self, raw: bytes, delimiter: str, dtypes: Optional[Dict] = None) -> pd.DataFrame:
+        """Однократный разбор CSV прямо из байтов ответа"""
+        return pd.read_csv(
+            io.BytesIO(raw),
+            sep=delimiter,
+            dtype=dtypes,
+            encoding='utf-8',
+            encoding_errors='ignore'
+        )
+    
+    def parse_group_csv(self, group: str, raw: bytes) -> pd.DataFrame:
+        """Разбор CSV группы с кэшированием диалекта и схемы колонок"""
+        schema = self.csv_schemas.get(group)
+        if schema:
+            # Повторная загрузка: разделитель и типы уже известны
+            try:
+                df = self.read_csv_bytes(raw, schema['delimiter'], schema['dtypes'])
+                if list(df.columns) == schema['columns']:
+                    return df
+                print(f"Группа {group}: схема колонок изменилась, определяем заново")
+            except (ValueError, pd.errors.ParserError) as e:
+                print(f"Группа {group}: данные не соответствуют сохраненной схеме ({e}), определяем заново")
+        
+        delimiter = self.detect_csv_delimiter(raw)
+        df = self.read_csv_bytes(raw, delimiter)
+        print(f"Группа {group} загружена с разделителем {delimiter!r}")
+        
+        # Типы храним названиями: схемы сохраняются в JSON-заголовке снимка
+        self.csv_schemas[group] = {
+            'delimiter': delimiter,
+            'columns': list(df.columns),
+            'dtypes': {column: str(dtype) for column, dtype in df.dtypes.items()}
+        }
+        return df
+    
+    def process_group_data(self, group: str, raw: bytes) -> Optional[pd.DataFrame]:
+        """Разбор скачанного CSV группы в DataFrame"""
+        print(f"Группа {group}: получено {len(raw)} байт")
+        
+        try:
+            df = self.parse_group_csv(group, raw)
+        except Exception as e:
+            print(f"Не удалось загрузить группу {group}: {e}")
+            return None
+        
+        if df.empty:
+            return None
+        
+        # Очищаем данные
+        df = df.dropna(how='all')  # Удаляем полностью пустые строки
+        
+        # Логируем информацию о колонках
+        print(f"Группа {group}: колонки = {list(df.columns)}")
+        
+        # Добавляем нормализованные имена для поиска
+        columns = self.group_columns(group)
+        df['normalized_name'] = student_names(df, columns.get('name', NAME_COLUMNS)).map(self.normalize_text)
+        
+        # Флаг и текст сертификатов считаем один раз для всей группы
+        df = self.add_certificate_columns(df, columns.get('certificates'))
+        cert_count = int(df[CERT_FLAG_COLUMN].sum())
+        
+        print(f"Группа {group}: {len(df)} студентов, {cert_count} с сертификатами")
+        return df
     
     def get_user_language(self, user_id: int) -> str:
         """Получить язык пользователя"""
@@ -305,12 +2683,14 @@ class StudentBot:
     def set_user_language(self, user_id: int, language: str):
         """Установить язык пользователя"""
         user_id_str = str(user_id)
-        self.user_languages[user_id_str] = language
-        self.save_user_languages()
+        self.user_languages.set(user_id_str, language)
     
     def get_text(self, user_id: int, key: str, **kwargs) -> str:
         """Получить текст на языке пользователя"""
-        lang = self.get_user_language(user_id)
+        return self.translate(self.get_user_language(user_id), key, **kwargs)
+    
+    def translate(self, lang: str, key: str, **kwargs) -> str:
+        """Получить текст на заданном языке"""
         text = LANGUAGES[lang].get(key, key)
         if kwargs:
             text = text.format(**kwargs)
@@ -318,230 +2698,487 @@ class StudentBot:
     
     def create_main_menu(self, user_id: int) -> ReplyKeyboardMarkup:
         """Создать главное меню"""
-        keyboard = [
-            [KeyboardButton(self.get_text(user_id, 'search_by_name'))],
-            [KeyboardButton(self.get_text(user_id, 'show_group'))],
-            [KeyboardButton(self.get_text(user_id, 'statistics')), 
-             KeyboardButton(self.get_text(user_id, 'help'))],
-            [KeyboardButton(self.get_text(user_id, 'change_language'))]
-        ]
-        return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+        lang = self.get_user_language(user_id)
+        menu = self.main_menus.get(lang)
+        if menu is None:
+            # Клавиатура неизменяема, поэтому одна на всех пользователей языка
+            keyboard = [
+                [KeyboardButton(self.translate(lang, 'search_by_name'))],
+                [KeyboardButton(self.translate(lang, 'show_group'))],
+                [KeyboardButton(self.translate(lang, 'statistics')), 
+                 KeyboardButton(self.translate(lang, 'help'))],
+                [KeyboardButton(self.translate(lang, 'change_language'))]
+            ]
+            menu = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+            self.main_menus[lang] = menu
+        return menu
     
-    def search_student(self, query: str) -> List[Dict]:
-        """Поиск студента по имени и фамилии"""
-        results = []
+    def search_student(self, query: str, state: Optional[DataState] = None) -> List[Dict]:
+        """Поиск студента по имени и фамилии (в state или в текущей версии данных)"""
+        started = time.perf_counter()
         normalized_query = self.normalize_text(query)
     
         if not normalized_query:
+            return []
+        
+        # Поиск идет по всем группам, поэтому они должны быть загружены
+        self.ensure_searchable_groups()
+        if state is None:
+            state = self.state
+        # Результат общий для всех вызывающих и не должен изменяться
+        key = (state.version, normalized_query)
+        results = self.search_cache.get(key)
+        if results is not None:
+            search_results.observe(len(results))
             return results
     
-        print(f"Поиск по запросу: '{query}', нормализованный запрос: '{normalized_query}'")
-    
-        # Разбиваем запрос на слова для более гибкого поиска
-        query_words = normalized_query.split()
-    
-        for group, df in self.students_data.items():
-            if df.empty:
-                continue
-    
-            print(f"Поиск в группе {group}, студентов: {len(df)}")
-    
-            for index, row in df.iterrows():
-                # Получаем имя студента
-                student_name = self.get_student_name(row)
-                normalized_name = self.normalize_text(student_name)
-    
-                print(f"Проверяем студента: '{student_name}' -> '{normalized_name}'")
-    
-                # Проверяем точное совпадение
-                if normalized_query in normalized_name:
-                    student_info = {
-                        'group': group,
-                        'data': row,
-                        'index': index,
-                        'match_quality': 'high'
-                    }
-                    results.append(student_info)
-                    print(f"✅ Найдено точное совпадение: {student_name}")
-                    continue
-    
-                # Проверяем совпадение по словам (все слова запроса должны быть в имени)
-                if all(word in normalized_name for word in query_words):
-                    student_info = {
-                        'group': group,
-                        'data': row,
-                        'index': index,
-                        'match_quality': 'medium'
-                    }
-                    results.append(student_info)
-                    print(f"✅ Найдено совпадение по словам: {student_name}")
-                    continue
-    
-                # Проверяем частичное совпадение в любом поле
-                row_text = ' '.join(str(val) for val in row.values if pd.notna(val))
-                normalized_row_text = self.normalize_text(row_text)
-    
-                if normalized_query in normalized_row_text:
-                    student_info = {
-                        'group': group,
-                        'data': row,
-                        'index': index,
-                        'match_quality': 'low'
-                    }
-                    results.append(student_info)
-                    print(f"✅ Найдено частичное совпадение: {student_name}")
-    
-        # Сортируем результаты по качеству совпадения
-        quality_order = {'high': 0, 'medium': 1, 'low': 2}
-        results.sort(key=lambda x: quality_order.get(x['match_quality'], 3))
-    
-        print(f"Всего найдено результатов: {len(results)}")
+        trace = {}
+        results = state.search_index.search(normalized_query, trace)
+        # Ненайденные запросы тоже кэшируем, но ненадолго
+        self.search_cache.set(key, results, None if results else SEARCH_NEGATIVE_TTL)
+        search_results.observe(len(results))
+        
+        trace_search(query, normalized_query, trace, len(results), (time.perf_counter() - started) * 1000)
         return results
     
     def format_student_info(self, student: Dict, user_id: int) -> str:
         """Форматирование информации о студенте"""
-        row = student['data']
+        lang = self.get_user_language(user_id)
+        # Версия берется из результата: карточка по старой записи не попадет в кэш новой версии
+        key = (student['version'], student['group'], student['index'], lang)
+        info = self.student_cards.get(key)
+        if info is None:
+            info = self.render_student_card(student, lang)
+            self.student_cards.set(key, info)
+        return info
+    
+    def render_student_card(self, student: Dict, lang: str) -> str:
+        """Карточка студента на заданном языке"""
+        record = student['data']
         group = student['group']
         
         # Определяем статус экзамена по наличию сертификатов
-        has_cert = self.has_certificate(row)
-        exam_status = self.get_text(user_id, 'exam_passed') if has_cert else self.get_text(user_id, 'exam_failed')
+        has_cert = record.has_certificate
+        exam_status = self.translate(lang, 'exam_passed') if has_cert else self.translate(lang, 'exam_failed')
         
         # Получаем ФИО студента
-        name = self.get_student_name(row)
+        name = record.name
         
         # Форматируем информацию на языке пользователя
         # Используем обычный текст вместо Markdown для избежания проблем с форматированием
         info = f"┌{'─' * 35}┐\n"
         info += f"│ 👤 {name}\n"
-        info += f"│ 🏫 {self.get_text(user_id, 'group')}: {group}\n"
-        info += f"│ 📋 {self.get_text(user_id, 'status')}: {exam_status}\n"
+        info += f"│ 🏫 {self.translate(lang, 'group')}: {group}\n"
+        info += f"│ 📋 {self.translate(lang, 'status')}: {exam_status}\n"
         
         # Добавляем дополнительную информацию если есть
-        phone = self.get_student_phone(row)
+        phone = record.phone
         if phone:
-            info += f"│ {self.get_text(user_id, 'phone')}: {phone}\n"
+            info += f"│ {self.translate(lang, 'phone')}: {phone}\n"
         
-        nickname = self.get_student_nickname(row)
+        nickname = record.nickname
         if nickname:
-            info += f"│ {self.get_text(user_id, 'nickname')}: {nickname}\n"
+            info += f"│ {self.translate(lang, 'nickname')}: {nickname}\n"
         
-        certificates = self.get_student_certificates(row)
+        certificates = record.certificates
         if certificates:
-            info += f"│ {self.get_text(user_id, 'certificates')}: {certificates}\n"
+            info += f"│ {self.translate(lang, 'certificates')}: {certificates}\n"
         
         info += f"└{'─' * 35}┘"
         
         return info
     
-    def get_student_name(self, row: pd.Series) -> str:
-        """Получить имя студента из строки данных"""
-        # Проверяем различные возможные колонки с именами
-        name_columns = ['F.I.Sh', 'ФИО', 'Name', 'Имя', 'Full Name']
+    def render_search_results(self, query: str, user_id: int) -> Optional[str]:
+        """Поиск студента и текст ответа; None, если ничего не найдено"""
+        results = self.search_student(query)
+        if not results:
+            return None
+        
+        response = f"{self.get_text(user_id, 'student_found')}\n\n"
+        for student in results[:MAX_SEARCH_RESULTS]:
+            response += f"{self.format_student_info(student, user_id)}\n\n"
+        return response
+    
+    def bulk_lookup(self, names: List[str]) -> List[tuple]:
+        """Поиск списка имен; пары (имя, результаты) в порядке списка
         
-        for col in name_columns:
-            if col in row and pd.notna(row[col]):
-                return str(row[col]).strip()
+        Все имена ищутся одним проходом по индексу как подстроки имен
+        студентов, а к найденному добавляются (без повторов) результаты
+        обычного поиска: другой порядок слов, транслитерация, опечатки.
+        """
+        queries = [self.normalize_text(name) for name in names]
+        # Имена без единого слова из NGRAM букв индекс не сужает: это не имена
+        searchable = list(dict.fromkeys(
+            query for query in queries
+            if any(len(word) >= SearchIndex.NGRAM for word in transliterate(query).split())
+        ))
         
-        # Если не нашли по названию колонки, берем вторую колонку (обычно там имя)
-        if len(row) > 1 and pd.notna(row.iloc[1]):
-            return str(row.iloc[1]).strip()
+        self.ensure_searchable_groups()
+        state = self.state
+        found = dict(zip(searchable, state.search_index.match_many(searchable)))
         
-        return "Не указано"
+        merged = {}
+        for query in searchable:
+            results = list(found[query])
+            seen = {(student['group'], student['index']) for student in results}
+            for student in self.search_student(query, state):
+                if (student['group'], student['index']) not in seen:
+                    seen.add((student['group'], student['index']))
+                    results.append(student)
+            merged[query] = results
+        return [(name, merged.get(query, [])) for name, query in zip(names, queries)]
     
-    def get_student_phone(self, row: pd.Series) -> str:
-        """Получить телефон студента"""
-        phone_columns = ['Telefon nomeri', 'Phone', 'Телефон']
+    def render_bulk_results(self, names: List[str], user_id: int, as_document: bool = False) -> tuple:
+        """Ответ на список имен: (сообщения, CSV-файл или None)
+        
+        Длинный ответ (или ответ на файл) отправляется CSV-файлом,
+        тогда единственное сообщение — подпись к нему.
+        """
+        lang = self.get_user_language(user_id)
+        rows = self.bulk_lookup(names[:BULK_MAX_NAMES])
+        
+        header = self.translate(lang, 'bulk_header', found=sum(1 for _, results in rows if results),
+                                total=len(rows))
+        if len(names) > BULK_MAX_NAMES:
+            header += '\n' + self.translate(lang, 'bulk_truncated', limit=BULK_MAX_NAMES)
         
-        for col in phone_columns:
-            if col in row and pd.notna(row[col]):
-                phone = str(row[col]).strip()
-                if phone and phone != '':
-                    return phone
+        blocks = [header]
+        for number, (name, results) in enumerate(rows, 1):
+            lines = [f"{number}. {name}"]
+            if not results:
+                lines.append(f"   {self.translate(lang, 'bulk_not_found')}")
+            for student in results[:BULK_MATCHES_PER_NAME]:
+                record = student['data']
+                mark = '✅' if record.has_certificate else '❌'
+                lines.append(f"   {mark} {record.name} — {student['group']}")
+            if len(results) > BULK_MATCHES_PER_NAME:
+                lines.append(f"   {self.translate(lang, 'bulk_more', count=len(results) - BULK_MATCHES_PER_NAME)}")
+            blocks.append('\n'.join(lines))
         
-        return ""
+        messages = split_message(blocks)
+        if not as_document and len(messages) <= BULK_MAX_MESSAGES:
+            return messages, None
+        return [header], self.render_bulk_csv(rows, lang)
     
-    def get_student_nickname(self, row: pd.Series) -> str:
-        """Получить никнейм студента"""
-        nickname_columns = ['Nick name', 'Nickname', 'Никнейм']
+    def render_bulk_csv(self, rows: List[tuple], lang: str) -> bytes:
+        """CSV с результатами проверки списка: по строке на совпадение"""
+        output = io.StringIO()
+        writer = csv.writer(output, delimiter=';')
+        writer.writerow(self.translate(lang, 'bulk_csv_header').split(';'))
+        for name, results in rows:
+            if not results:
+                writer.writerow([name, '', '', self.translate(lang, 'bulk_not_found'), '', '', ''])
+            for student in results[:BULK_MATCHES_PER_NAME]:
+                record = student['data']
+                status = self.translate(lang, 'exam_passed' if record.has_certificate else 'exam_failed')
+                writer.writerow([name, record.name, student['group'], status,
+                                 record.phone, record.nickname, record.certificates])
+        # BOM нужен Excel, чтобы распознать UTF-8
+        return output.getvalue().encode('utf-8-sig')
+    
+    def read_name_list(self, raw: bytes, filename: str) -> List[str]:
+        """Имена из присланного файла: строки .txt или колонка ФИО .csv"""
+        try:
+            text = raw.decode('utf-8-sig')
+        except UnicodeDecodeError:
+            text = raw.decode('cp1251', errors='replace')
         
-        for col in nickname_columns:
-            if col in row and pd.notna(row[col]):
-                nickname = str(row[col]).strip()
-                if nickname and nickname != '':
-                    return nickname
+        if not filename.lower().endswith('.csv'):
+            return split_name_list(text)
         
-        return ""
+        delimiter = self.detect_csv_delimiter(raw)
+        rows = [row for row in csv.reader(io.StringIO(text), delimiter=delimiter) if any(cell.strip() for cell in row)]
+        if not rows:
+            return []
+        # Колонка с ФИО по заголовку, иначе первая
+        header = [cell.strip().lower() for cell in rows[0]]
+        known = [column.lower() for column in NAME_COLUMNS]
+        column = next((i for i, cell in enumerate(header) if cell in known), None)
+        if column is None:
+            column = 0
+        else:
+            rows = rows[1:]
+        return split_name_list('\n'.join(row[column] for row in rows if column < len(row)))
     
-    def get_student_certificates(self, row: pd.Series) -> str:
-        """Получить информацию о сертификатах студента"""
-        cert_columns = []
+    def filter_students(self, conditions: Dict[str, List[str]], limit: Optional[int] = None) -> tuple:
+        """Студенты всех (или выбранных) групп, подходящие под условия фильтра
+        
+        Возвращает (число найденных, первые limit студентов): результаты
+        для ответа строятся только для показываемых студентов.
+        """
+        # У процесса-обработчика нет источников, только опубликованные группы
+        groups = list(self.urls) or list(self.state.group_indexes)
+        if 'group' in conditions:
+            wanted = {value.lower() for value in conditions['group']}
+            groups = [group for group in groups if group.lower() in wanted]
+            self.ensure_groups(groups)
+        else:
+            self.ensure_searchable_groups()
         
-        for col in row.index:
-            col_lower = str(col).lower()
-            if any(keyword in col_lower for keyword in ['sertifikat', 'certificate', 'cert']):
-                cert_columns.append(col)
+        state = self.state
+        count = 0
+        students = []
+        for group in groups:
+            index = state.group_indexes.get(group)
+            if index is None:
+                continue
+            positions = state.group_filters[group].match(conditions)
+            count += len(positions)
+            start = index.store.group_range(group).start
+            for position in positions[:None if limit is None else max(limit - len(students), 0)]:
+                students.append(state.search_index.student(index, start + int(position), 'filter'))
+        return count, students
+    
+    def render_filter_results(self, args: List[str], user_id: int) -> List[str]:
+        """Ответ на /filter: найденное число и карточки первых студентов"""
+        try:
+            conditions = parse_filter(args)
+        except ValueError:
+            return [self.get_text(user_id, 'filter_usage')]
         
-        certificates = []
-        for col in cert_columns:
-            if pd.notna(row[col]):
-                cert = str(row[col]).strip()
-                if cert and cert.lower() not in ['', 'nan', 'none', 'null', '-', 'n/a']:
-                    certificates.append(cert)
+        count, students = self.filter_students(conditions, FILTER_MAX_RESULTS)
+        if not count:
+            return [self.get_text(user_id, 'no_students_found')]
         
-        return ', '.join(certificates) if certificates else ""
+        blocks = [self.get_text(user_id, 'filter_found', count=count)]
+        for student in students:
+            blocks.append(self.format_student_info(student, user_id))
+        if count > FILTER_MAX_RESULTS:
+            blocks.append(self.get_text(user_id, 'filter_truncated', limit=FILTER_MAX_RESULTS))
+        return split_message(blocks)
     
-    def get_group_students(self, group: str) -> pd.DataFrame:
-        """Получить студентов группы"""
-        return self.students_data.get(group, pd.DataFrame())
+    def get_group_page(self, group: str, page: int, user_id: int) -> Optional[tuple]:
+        """Страница списка группы (текст, клавиатура); None, если группа пуста"""
+        self.ensure_groups([group])
+        lang = self.get_user_language(user_id)
+        # Кэш принадлежит версии данных и заменяется вместе с ней
+        state = self.state
+        pages = state.group_pages.get((group, lang))
+        if pages is None:
+            pages = self.render_group_pages(state.group_indexes.get(group), group, lang)
+            state.group_pages[(group, lang)] = pages
+        
+        if not pages:
+            return None
+        return pages[min(max(page, 0), len(pages) - 1)]
     
-    def get_statistics(self, user_id: int) -> str:
-        """Получить статистику"""
-        total_students = 0
-        passed_exam = 0
-        failed_exam = 0
+    def render_group_pages(self, index: Optional[SearchIndex], group: str, lang: str) -> List[tuple]:
+        """Все страницы списка группы на заданном языке"""
+        if index is None or not len(index):
+            return []
         
-        group_stats = {}
+        names = list(index.store.names)
+        statuses = ["✅" if flag else "❌" for flag in index.store.cert_flags]
+        page_count = (len(names) + GROUP_PAGE_SIZE - 1) // GROUP_PAGE_SIZE
+        back_button = InlineKeyboardButton(self.translate(lang, 'back_to_menu'), callback_data="back_to_menu")
         
-        for group, df in self.students_data.items():
-            if df.empty:
-                continue
-                
-            group_total = len(df)
-            total_students += group_total
-            
-            # Подсчитываем сдавших экзамен (у кого есть сертификаты)
-            group_passed = 0
-            for _, row in df.iterrows():
-                if self.has_certificate(row):
-                    group_passed += 1
+        pages = []
+        for page in range(page_count):
+            start = page * GROUP_PAGE_SIZE
+            response = self.translate(lang, 'students_in_group', group=group) + "\n"
+            response += self.translate(lang, 'page', page=page + 1, pages=page_count) + "\n\n"
+            for position in range(start, min(start + GROUP_PAGE_SIZE, len(names))):
+                response += f"{position + 1}. {statuses[position]} {names[position]}\n"
             
-            group_failed = group_total - group_passed
-            passed_exam += group_passed
-            failed_exam += group_failed
+            # Кнопки перелистывания и "Назад"
+            navigation = []
+            if page > 0:
+                navigation.append(InlineKeyboardButton("⬅️", callback_data=f"group_{group}:{page - 1}"))
+            if page < page_count - 1:
+                navigation.append(InlineKeyboardButton("➡️", callback_data=f"group_{group}:{page + 1}"))
+            keyboard = [navigation, [back_button]] if navigation else [[back_button]]
             
-            group_stats[group] = {
-                'total': group_total,
-                'passed': group_passed,
-                'failed': group_failed
-            }
+            pages.append((response, InlineKeyboardMarkup(keyboard)))
+        return pages
+    
+    def inline_results(self, query: str, user_id: int) -> List[InlineQueryResultArticle]:
+        """Результаты inline-запроса по префиксу имени"""
+        normalized_query = self.normalize_text(query)
+        if not normalized_query:
+            return []
+        
+        self.ensure_searchable_groups()
+        lang = self.get_user_language(user_id)
+        state = self.state
+        key = (state.version, lang, normalized_query)
+        results = self.inline_cache.get(key)
+        if results is not None:
+            return results
+        
+        results = []
+        for student in state.search_index.prefix_search(normalized_query, INLINE_RESULTS_LIMIT):
+            status_key = 'exam_passed' if student['data'].has_certificate else 'exam_failed'
+            results.append(InlineQueryResultArticle(
+                id=f"{student['group']}:{student['index']}",
+                title=student['data'].name,
+                description=f"{self.translate(lang, 'group')}: {student['group']} · {self.translate(lang, status_key)}",
+                input_message_content=InputTextMessageContent(self.format_student_info(student, user_id))
+            ))
+        
+        self.inline_cache.set(key, results)
+        return results
+    
+    def group_keyboard(self) -> InlineKeyboardMarkup:
+        """Клавиатура выбора группы по реестру"""
+        if self.group_keyboard_markup is None:
+            buttons = [InlineKeyboardButton(group, callback_data=f"group_{group}") for group in self.registry]
+            self.group_keyboard_markup = InlineKeyboardMarkup([
+                buttons[start:start + GROUP_KEYBOARD_COLUMNS]
+                for start in range(0, len(buttons), GROUP_KEYBOARD_COLUMNS)
+            ])
+        return self.group_keyboard_markup
+    
+    def compute_group_stats(self, store: StudentStore) -> Dict[str, int]:
+        """Подсчет сдавших и не сдавших экзамен в группе"""
+        group_total = len(store)
+        # Подсчитываем сдавших экзамен (у кого есть сертификаты)
+        group_passed = store.cert_flags.count(1)
+        return {
+            'total': group_total,
+            'passed': group_passed,
+            'failed': group_total - group_passed
+        }
+    
+    def get_statistics(self, user_id: int) -> str:
+        """Получить статистику"""
+        # Для статистики нужны группы, которые еще ни разу не загружались
+        self.ensure_groups([group for group in self.urls if group not in self.state.group_stats], protected=set())
+        lang = self.get_user_language(user_id)
+        # Кэш принадлежит версии данных и заменяется вместе с ней
+        state = self.state
+        stats = state.stats_texts.get(lang)
+        if stats is None:
+            stats = self.render_statistics(state.group_stats, lang)
+            state.stats_texts[lang] = stats
+        return stats
+    
+    def render_statistics(self, group_stats: Dict[str, Dict[str, int]], lang: str) -> str:
+        """Текст статистики на заданном языке по статистике групп одной версии"""
+        total_students = sum(stat['total'] for stat in group_stats.values())
+        passed_exam = sum(stat['passed'] for stat in group_stats.values())
+        failed_exam = sum(stat['failed'] for stat in group_stats.values())
         
-        stats = f"📊 {self.get_text(user_id, 'statistics')}\n\n"
-        stats += f"{self.get_text(user_id, 'total_students', count=total_students)}\n"
-        stats += f"{self.get_text(user_id, 'passed_exam_count', count=passed_exam)}\n"
-        stats += f"{self.get_text(user_id, 'failed_exam_count', count=failed_exam)}\n\n"
+        stats = f"📊 {self.translate(lang, 'statistics')}\n\n"
+        stats += f"{self.translate(lang, 'total_students', count=total_students)}\n"
+        stats += f"{self.translate(lang, 'passed_exam_count', count=passed_exam)}\n"
+        stats += f"{self.translate(lang, 'failed_exam_count', count=failed_exam)}\n\n"
         
         # Статистика по группам
         for group, group_stat in group_stats.items():
-            stats += f"{group}: {group_stat['total']} ({self.get_text(user_id, 'has_certificate')}: {group_stat['passed']})\n"
+            stats += f"{group}: {group_stat['total']} ({self.translate(lang, 'has_certificate')}: {group_stat['passed']})\n"
         
         return stats
 
-# Создаем экземпляр бота
-print("Инициализация бота...")
-bot = StudentBot()
-print("Бот инициализирован")
+# Экземпляр бота создается в main(), чтобы импорт модуля не загружал данные
+bot: Optional[StudentBot] = None
+
+# Бот процесса-обработчика; пересоздается при смене опубликованного снимка
+worker_bot: Optional[StudentBot] = None
+
+def run_worker_task(roster_path: str, method: str, languages: Dict[str, str], *args):
+    """Выполнение метода бота в процессе-обработчике по снимку roster_path"""
+    global worker_bot
+    if worker_bot is None or worker_bot.roster_path != roster_path:
+        if worker_bot is not None:
+            worker_bot.user_languages.close()
+        worker_bot = StudentBot.from_roster(roster_path)
+    for user_id, lang in languages.items():
+        worker_bot.set_user_language(user_id, lang)
+    return getattr(worker_bot, method)(*args)
+
+def cache_stats(field: str) -> Dict[tuple, int]:
+    """Счетчик всех кэшей бота для /metrics"""
+    if bot is None:
+        return {}
+    caches = {'search': bot.search_cache, 'cards': bot.student_cards, 'inline': bot.inline_cache}
+    return {(name,): cache.stats()[field] for name, cache in caches.items()}
+
+metrics.register(CallbackCollector('bot_students', 'Студентов в текущей версии данных', 'gauge',
+                                   lambda: {(): len(bot.state.search_index) if bot else 0}))
+metrics.register(CallbackCollector('bot_data_version', 'Номер текущей версии данных', 'gauge',
+                                   lambda: {(): bot.state.version if bot else 0}))
+metrics.register(CallbackCollector('bot_ready', 'Начальная загрузка данных завершена', 'gauge',
+                                   lambda: {(): int(bot is not None and bot.ready.is_set())}))
+metrics.register(CallbackCollector(
+    'bot_startup_phase_seconds', 'Длительность фаз запуска', 'gauge',
+    lambda: {(phase,): seconds for phase, seconds in bot.startup_timings.items()} if bot else {}, ('phase',)
+))
+metrics.register(CallbackCollector('bot_cache_size', 'Записей в кэше', 'gauge',
+                                   lambda: cache_stats('size'), ('cache',)))
+for field in ('hits', 'misses', 'evictions', 'expirations'):
+    metrics.register(CallbackCollector(f'bot_cache_{field}_total', f'Кэш: {field}', 'counter',
+                                       functools.partial(cache_stats, field), ('cache',)))
+
+executor = DataExecutor(WORKER_THREADS, WORKER_QUEUE_LIMIT, WORKER_TIMEOUT)
+
+async def wait_ready() -> bool:
+    """Дождаться начальной загрузки данных не дольше READY_TIMEOUT"""
+    if bot.ready.is_set():
+        return True
+    try:
+        await asyncio.wait_for(bot.ready.wait(), READY_TIMEOUT)
+        return True
+    except asyncio.TimeoutError:
+        return False
+
+async def run_data_task(user_id: int, reply, func, *args):
+    """Выполнить операцию с данными в пуле; при перегрузке сообщить пользователю
+    
+    Пока данные загружаются после запуска, пользователь получает ответ
+    «данные загружаются». Возвращает кортеж (выполнено, результат).
+    """
+    if not await wait_ready():
+        await reply(bot.get_text(user_id, 'loading'))
+        return False, None
+    try:
+        return True, await executor.run(func, *args, user_id=user_id)
+    except (Overloaded, asyncio.TimeoutError):
+        overloaded_total.labels(func.__name__).inc()
+        logger.warning(f"Операция {func.__name__} отклонена: пул перегружен или превышен таймаут")
+        await reply(bot.get_text(user_id, 'busy'))
+        return False, None
+
+user_limiter = UserRateLimiter(USER_RATE, USER_BURST)
+inline_limiter = UserRateLimiter(INLINE_RATE, INLINE_BURST)
+
+def instrumented(handler):
+    """Счетчики, ошибки и длительность обработки обновлений для /metrics"""
+    name = handler.__name__
+    
+    @functools.wraps(handler)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        updates_total.labels(name).inc()
+        started = time.perf_counter()
+        try:
+            return await handler(update, context)
+        except Exception:
+            handler_errors_total.labels(name).inc()
+            raise
+        finally:
+            handler_seconds.labels(name).observe(time.perf_counter() - started)
+    return wrapper
+
+def rate_limited(limiter: UserRateLimiter):
+    """Пропускать обновления пользователя в обработчик не чаще лимита"""
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+            user = update.effective_user
+            if user is None or limiter.allow(user.id):
+                return await handler(update, context)
+            
+            rate_limited_total.labels(handler.__name__).inc()
+            if update.callback_query:
+                # На callback нужно ответить в любом случае, иначе кнопка "зависнет"
+                text = bot.get_text(user.id, 'rate_limited') if limiter.should_warn(user.id) else None
+                await update.callback_query.answer(text)
+            elif update.message and limiter.should_warn(user.id):
+                await update.message.reply_text(bot.get_text(user.id, 'rate_limited'))
+        return wrapper
+    return decorator
 
+@instrumented
+@rate_limited(user_limiter)
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик команды /start"""
     user_id = update.effective_user.id
@@ -553,6 +3190,8 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         reply_markup=main_menu
     )
 
+@instrumented
+@rate_limited(user_limiter)
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик текстовых сообщений"""
     user_id = update.effective_user.id
@@ -570,21 +3209,15 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         context.user_data['waiting_for'] = 'student_name'
         
     elif text in show_group_commands:
-        keyboard = [
-            [InlineKeyboardButton("D1", callback_data="group_D1"),
-             InlineKeyboardButton("D2", callback_data="group_D2")],
-            [InlineKeyboardButton("D3", callback_data="group_D3"),
-             InlineKeyboardButton("D4", callback_data="group_D4")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
         await update.message.reply_text(
             bot.get_text(user_id, 'choose_group'),
-            reply_markup=reply_markup
+            reply_markup=bot.group_keyboard()
         )
         
     elif text in statistics_commands:
-        stats = bot.get_statistics(user_id)
-        await update.message.reply_text(stats)
+        done, stats = await run_data_task(user_id, update.message.reply_text, bot.get_statistics, user_id)
+        if done:
+            await update.message.reply_text(stats)
         
     elif text in help_commands:
         help_text = bot.get_text(user_id, 'help_text')
@@ -602,27 +3235,30 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
             reply_markup=reply_markup
         )
         
+    elif len(split_name_list(text)) > 1:
+        # Список имен (по одному в строке) проверяется одним ответом
+        await reply_bulk_results(update, user_id, split_name_list(text))
+        context.user_data['waiting_for'] = None
+        
     elif context.user_data.get('waiting_for') == 'student_name':
         # Поиск студента
-        results = bot.search_student(text)
-        
-        if results:
-            response = f"{bot.get_text(user_id, 'student_found')}\n\n"
-            for i, student in enumerate(results[:5]):  # Показываем максимум 5 результатов
-                response += f"{bot.format_student_info(student, user_id)}\n\n"
-        else:
-            response = bot.get_text(user_id, 'no_students_found')
+        done, response = await run_data_task(
+            user_id, update.message.reply_text, bot.render_search_results, text, user_id
+        )
+        if not done:
+            return
         
-        await update.message.reply_text(response)
+        await update.message.reply_text(response or bot.get_text(user_id, 'no_students_found'))
         context.user_data['waiting_for'] = None
     else:
         # Если текст не распознан как команда, пробуем искать студента
-        results = bot.search_student(text)
+        done, response = await run_data_task(
+            user_id, update.message.reply_text, bot.render_search_results, text, user_id
+        )
+        if not done:
+            return
         
-        if results:
-            response = f"{bot.get_text(user_id, 'student_found')}\n\n"
-            for i, student in enumerate(results[:5]):  # Показываем максимум 5 результатов
-                response += f"{bot.format_student_info(student, user_id)}\n\n"
+        if response:
             await update.message.reply_text(response)
         else:
             # Если ничего не найдено, показываем главное меню
@@ -632,6 +3268,58 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 reply_markup=main_menu
             )
 
+@instrumented
+@rate_limited(user_limiter)
+async def handle_filter(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /filter"""
+    user_id = update.effective_user.id
+    done, messages = await run_data_task(
+        user_id, update.message.reply_text, bot.render_filter_results, context.args or [], user_id
+    )
+    if not done:
+        return
+    for message in messages:
+        await update.message.reply_text(message)
+
+async def reply_bulk_results(update: Update, user_id: int, names: List[str], as_document: bool = False):
+    """Ответ на список имен: сообщениями или CSV-файлом"""
+    done, response = await run_data_task(
+        user_id, update.message.reply_text, bot.render_bulk_results, names, user_id, as_document
+    )
+    if not done:
+        return
+    
+    messages, document = response
+    if document is not None:
+        await update.message.reply_document(document=document, filename='students.csv', caption=messages[0])
+        return
+    for message in messages:
+        await update.message.reply_text(message)
+
+@instrumented
+@rate_limited(user_limiter)
+async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик файлов со списком имен (.txt, .csv)"""
+    user_id = update.effective_user.id
+    document = update.message.document
+    if document.file_size and document.file_size > BULK_MAX_FILE_SIZE:
+        await update.message.reply_text(
+            bot.get_text(user_id, 'bulk_file_error', size=BULK_MAX_FILE_SIZE // 1024)
+        )
+        return
+    
+    file = await document.get_file()
+    raw = bytes(await file.download_as_bytearray())
+    names = bot.read_name_list(raw, document.file_name or '')
+    if not names:
+        await update.message.reply_text(
+            bot.get_text(user_id, 'bulk_file_error', size=BULK_MAX_FILE_SIZE // 1024)
+        )
+        return
+    await reply_bulk_results(update, user_id, names, as_document=True)
+
+@instrumented
+@rate_limited(user_limiter)
 async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик callback запросов"""
     query = update.callback_query
@@ -641,30 +3329,23 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.answer()
     
     if data.startswith('group_'):
-        group = data.split('_')[1]
-        df = bot.get_group_students(group)
+        group, _, page = data[len('group_'):].partition(':')
+        # Данные кнопки приходят от клиента: некорректный номер страницы считаем первой страницей
+        try:
+            page = int(page or 0)
+        except ValueError:
+            page = 0
+        done, page_content = await run_data_task(
+            user_id, query.edit_message_text, bot.get_group_page, group, page, user_id
+        )
+        if not done:
+            return
         
-        if df.empty:
+        if page_content is None:
             await query.edit_message_text(bot.get_text(user_id, 'no_students_found'))
             return
         
-        response = bot.get_text(user_id, 'students_in_group', group=group) + "\n\n"
-        
-        for index, row in df.iterrows():
-            if index >= 20:  # Ограничиваем вывод 20 студентами
-                response += f"\n... и еще {len(df) - 20} студентов"
-                break
-                
-            name = bot.get_student_name(row)
-            has_cert = bot.has_certificate(row)
-            status = "✅" if has_cert else "❌"
-            
-            response += f"{index + 1}. {status} {name}\n"
-        
-        # Добавляем кнопку "Назад"
-        keyboard = [[InlineKeyboardButton(bot.get_text(user_id, 'back_to_menu'), callback_data="back_to_menu")]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
+        response, reply_markup = page_content
         await query.edit_message_text(response, reply_markup=reply_markup)
         
     elif data.startswith('lang_'):
@@ -689,21 +3370,155 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             reply_markup=main_menu
         )
 
+@instrumented
+@rate_limited(inline_limiter)
+async def handle_inline_query(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик inline-запросов (@бот имя)"""
+    inline_query = update.inline_query
+    results = []
+    try:
+        # В ленивом режиме первый запрос может загружать группы
+        if await wait_ready():
+            results = await executor.run(bot.inline_results, inline_query.query, inline_query.from_user.id,
+                                         user_id=inline_query.from_user.id)
+    except (Overloaded, asyncio.TimeoutError):
+        overloaded_total.labels('inline_results').inc()
+    await inline_query.answer(results, cache_time=INLINE_TELEGRAM_CACHE_TIME, is_personal=True)
+
+async def post_init(application: Application):
+    """Запуск фоновых задач после инициализации приложения"""
+    if METRICS_PORT:
+        # Служебный сервер работает в том же цикле событий, что и бот; журнал запросов не нужен
+        service = tornado.web.Application([('/metrics', MetricsHandler), ('/health', HealthHandler)],
+                                          log_function=lambda handler: None)
+        try:
+            application.bot_data['metrics_server'] = service.listen(METRICS_PORT, METRICS_LISTEN)
+            logger.info(f"Служебный сервер слушает {METRICS_LISTEN}:{METRICS_PORT}")
+        except OSError as e:
+            logger.error(f"Не удалось запустить служебный сервер на порту {METRICS_PORT}: {e}")
+    
+    # Данные загружаются в фоне: обновления принимаются сразу после запуска
+    application.bot_data['data_task'] = asyncio.create_task(load_and_refresh(application))
+    if isinstance(executor, WorkerProcessExecutor):
+        executor.warm_up()
+
+async def load_and_refresh(application: Application):
+    """Начальная загрузка данных, затем планирование их периодического обновления"""
+    await bot.startup()
+    # После старта из снимка данные сразу перепроверяются по сети
+    first = 0 if bot.loaded_from_snapshot else REFRESH_INTERVAL
+    if REFRESH_INTERVAL > 0:
+        application.job_queue.run_repeating(refresh_data, interval=REFRESH_INTERVAL, first=first)
+    elif bot.loaded_from_snapshot:
+        application.job_queue.run_once(refresh_data, 0)
+
+async def refresh_data(context: ContextTypes.DEFAULT_TYPE):
+    """Задача JobQueue: фоновое обновление данных"""
+    await bot.refresh_data()
+
+async def post_shutdown(application: Application):
+    """Остановка фоновых задач"""
+    task = application.bot_data.pop('data_task', None)
+    if task:
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+    server = application.bot_data.pop('metrics_server', None)
+    if server:
+        server.stop()
+        await server.close_all_connections()
+    bot.user_languages.close()
+    executor.shutdown()
+    bot.remove_rosters()
+
+class HealthHandler(tornado.web.RequestHandler):
+    """Проверка работоспособности для балансировщика
+    
+    Пока идет начальная загрузка данных, отвечает 503, чтобы трафик
+    не направлялся на еще не готовую реплику.
+    """
+
+    def get(self):
+        ready = bot.ready.is_set()
+        state = bot.state
+        payload = {
+            'status': 'ok' if ready else 'loading',
+            'data_version': state.version,
+            'students': len(state.search_index),
+            'search_cache': bot.search_cache.stats(),
+            'startup': {phase: round(seconds, 3) for phase, seconds in bot.startup_timings.items()}
+        }
+        self.set_status(200 if ready else 503)
+        self.set_header('Content-Type', 'application/json')
+        self.finish(json.dumps(payload))
+
+class MetricsHandler(tornado.web.RequestHandler):
+    """Метрики в текстовом формате Prometheus"""
+
+    def get(self):
+        self.set_header('Content-Type', CONTENT_TYPE_LATEST)
+        self.finish(generate_latest(metrics))
+
 def main():
     """Запуск бота"""
+    global bot, executor
     try:
+        if not BOT_TOKEN:
+            raise ValueError("BOT_TOKEN не найден в переменных окружения!")
+        if WORKER_PROCESSES > 0 and GROUPS_LAZY:
+            raise ValueError("GROUPS_LAZY нельзя использовать вместе с WORKER_PROCESSES")
+        
+        # Создаем экземпляр бота; данные загружаются в фоне после запуска приложения
+        print("Инициализация бота...")
+        if WORKER_PROCESSES > 0:
+            bot = StudentBot(autoload=False, roster_dir=ROSTER_DIR)
+            executor = WorkerProcessExecutor(bot, WORKER_PROCESSES, WORKER_QUEUE_LIMIT, WORKER_TIMEOUT)
+            print(f"Операции с данными выполняют {WORKER_PROCESSES} процессов, снимок данных в {ROSTER_DIR}")
+        else:
+            bot = StudentBot(autoload=False)
+        print(f"Бот инициализирован (импорт зависимостей {IMPORT_SECONDS:.2f}s)")
+        
         print("Запуск бота...")
         # Создаем приложение
-        application = Application.builder().token(BOT_TOKEN).build()
+        application = (
+            Application.builder()
+            .token(BOT_TOKEN)
+            .post_init(post_init)
+            .post_shutdown(post_shutdown)
+            .concurrent_updates(CONCURRENT_UPDATES)
+            .rate_limiter(TelegramRateLimiter())
+            .build()
+        )
         
         # Добавляем обработчики
         application.add_handler(CommandHandler("start", start))
+        application.add_handler(CommandHandler("filter", handle_filter))
         application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+        application.add_handler(MessageHandler(
+            filters.Document.FileExtension('txt') | filters.Document.FileExtension('csv'), handle_document
+        ))
         application.add_handler(CallbackQueryHandler(handle_callback))
+        application.add_handler(InlineQueryHandler(handle_inline_query))
         
         # Запускаем бота
-        print("Бот запущен на Railway...")
-        application.run_polling(allowed_updates=Update.ALL_TYPES)
+        if BOT_MODE == 'webhook':
+            if not WEBHOOK_URL or not WEBHOOK_SECRET:
+                raise ValueError("WEBHOOK_URL и WEBHOOK_SECRET обязательны в режиме вебхука!")
+            print("Бот запущен в режиме вебхука...")
+            # Встроенный сервер регистрирует вебхук, проверяет секрет и по SIGTERM
+            # сначала перестает принимать запросы, затем дорабатывает очередь обновлений
+            application.run_webhook(
+                listen=WEBHOOK_LISTEN,
+                port=PORT,
+                url_path=WEBHOOK_PATH,
+                webhook_url=WEBHOOK_URL + WEBHOOK_PATH,
+                secret_token=WEBHOOK_SECRET,
+                allowed_updates=Update.ALL_TYPES,
+                max_connections=CONCURRENT_UPDATES
+            )
+        else:
+            print("Бот запущен на Railway...")
+            application.run_polling(allowed_updates=Update.ALL_TYPES)
         
     except Exception as e:
         print(f"Ошибка запуска бота: {e}")